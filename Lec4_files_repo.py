@@ -329,6 +329,1581 @@ df_counts.to_csv("wordcount.csv")
 print(df_words)
 
 
+# ##### Compressed files
+#
+# Text files get much smaller when compressed. Python can read and write compressed files directly, the data is (de)compressed piece by piece while reading or writing, without temporary files:
+#
+# - `gzip` (`.gz`), `bz2` (`.bz2`) and `lzma` (`.xz`) are part of Python. `.zst` files need the package `zstandard`.
+# - `open_file()` chooses the method by the file extension and otherwise works like `open()`. Text mode (`"r"`, `"w"`) decodes the bytes like a normal text file.
+# - The functions below use `open_file()`, so e.g. `read_table("weather.txt.gz")` just works. `pandas` does the same in `to_csv("wordcount.csv.gz")` and `read_csv()`.
+# - A compressed file cannot jump to a byte position without decompressing everything before it. The binary column format and the index of a table need positions and therefore stay uncompressed, and a compressed text file is counted as a single range.
+
+# In[ ]:
+
+
+import bz2
+import gzip
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def open_zstd(filename, mode="rb", level=3):
+    """ This function opens a zstandard compressed file"""
+
+    if zstandard is None:
+        raise ImportError(f"{filename}: .zst files need the package zstandard")
+    return zstandard.open(filename, mode, cctx=zstandard.ZstdCompressor(level=level))
+
+
+# extension: function opening the file, name of its compression level argument
+OPENERS = {".gz": (gzip.open, "compresslevel"),
+           ".bz2": (bz2.open, "compresslevel"),
+           ".xz": (lzma.open, "preset"),
+           ".zst": (open_zstd, "level")}
+
+
+def is_compressed(filename):
+    """ This function returns True for file names of compressed files"""
+
+    return os.path.splitext(filename)[1] in OPENERS
+
+
+def open_file(filename, mode="r", level=None):
+    """ This function opens a file like open(), compressed files are
+    (de)compressed depending on the file extension"""
+
+    extension = os.path.splitext(filename)[1]
+    if extension not in OPENERS:
+        return open(filename, mode)
+    opener, keyword = OPENERS[extension]
+    if "b" not in mode:
+        mode = mode + "t"
+    if level is None or "r" in mode:
+        return opener(filename, mode)
+    return opener(filename, mode, **{keyword: level})
+
+
+with open("pride_and_prejudice.txt", "r") as text:
+    book = text.read()
+with open_file("pride_and_prejudice.txt.gz", "w") as text:
+    text.write(book)
+with open_file("pride_and_prejudice.txt.gz", "r") as text:
+    print(text.read() == book)
+print(os.path.getsize("pride_and_prejudice.txt"), os.path.getsize("pride_and_prejudice.txt.gz"))
+
+
+# ##### Counting words without storing them
+#
+# The list `all_words` above keeps *every* word of the book in memory and the DataFrame copies it once more. For large text files this does not work any more.
+#
+# - The file is read in chunks of fixed size with `.read(size)`.
+# - A chunk can end in the middle of a word. The incomplete last word is kept and put in front of the next chunk.
+# - A dictionary (hash table) stores one count per *distinct* word. Its size depends on the vocabulary, not on the length of the text.
+# - Dictionaries remember the order in which keys were added. A *stable* sort with `sort_values` keeps words with equal counts in that order and gives the same ranking as `value_counts()`.
+
+# In[ ]:
+
+
+def count_words(filename, chunk_size=1 << 20):
+    """ This function reads a text file in chunks and returns a
+    dictionary with the number of occurrences of every cleaned word"""
+
+    counts = {}
+    rest = ""
+    with open_file(filename, "r") as text:
+        while True:
+            chunk = text.read(chunk_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            words = chunk.split()
+            # last word may continue in the next chunk
+            if words and not chunk[-1].isspace():
+                rest = words.pop()
+            else:
+                rest = ""
+            for word in words:
+                word = remove(word)
+                counts[word] = counts.get(word, 0) + 1
+    # the last word of the file
+    if rest:
+        word = remove(rest)
+        counts[word] = counts.get(word, 0) + 1
+
+    return counts
+
+
+def counts_to_series(counts):
+    """ This function converts a dictionary of word counts into a
+    pandas Series sorted like value_counts()"""
+
+    series = pd.Series(counts, dtype="int64", name="count")
+    series.index.name = "words"
+    return series.sort_values(ascending=False, kind="stable")
+
+
+df_counts = counts_to_series(count_words("pride_and_prejudice.txt"))
+
+print(df_counts.iloc[100:120])
+df_counts.to_csv("wordcount.csv")
+
+
+# Let's compare time and memory of both methods. `tracemalloc` records the peak memory used by Python objects.
+
+# In[ ]:
+
+
+import time
+import tracemalloc
+
+def count_words_dataframe(filename):
+    """ This function is the list + DataFrame version from above"""
+
+    all_words = []
+    with open_file(filename, "r") as text:
+        for line in text:
+            for word in line.split():
+                all_words.append(remove(word))
+    df_words = pd.DataFrame(data=all_words, columns=("words",))
+    return df_words["words"].value_counts()
+
+
+for name, method in [("DataFrame", count_words_dataframe),
+                     ("streaming", lambda f: counts_to_series(count_words(f)))]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = method("pride_and_prejudice.txt")
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:10s} {elapsed:8.3f} s  peak memory {peak / 1e6:8.1f} MB")
+
+# both methods give the same ranking
+print(result.equals(count_words_dataframe("pride_and_prejudice.txt")))
+
+
+# ##### A faster `remove()` with a translation table
+#
+# `remove()` walks through every word eight times: encode, decode, `lower()` and six times `replace()`. The method `.translate(table, delete)` of `bytes` does the case conversion and the removal of punctuation in a single pass.
+#
+# - `bytes.maketrans(old, new)` creates a table of 256 bytes which replaces every byte in `old` by the byte at the same position in `new`.
+# - All bytes listed in `delete` are removed.
+# - Encoding with `'ascii', 'ignore'` drops the non-ascii signs as before.
+#
+# Instead of cleaning each word on its own, the words of a line are joined with single blanks, cleaned together and split again at the blanks. Empty words (e.g. a lonely `"!"`) are kept, exactly like `remove()` does.
+
+# In[ ]:
+
+
+import string
+
+
+def make_table(punctuation=".,:;!?"):
+    """ This function returns a translation table converting letters to
+    lower case and the punctuation marks to be deleted"""
+
+    table = bytes.maketrans(string.ascii_uppercase.encode(),
+                            string.ascii_lowercase.encode())
+    return table, punctuation.encode("ascii", "ignore")
+
+
+TABLE = make_table()
+
+
+def normalize_words(words, table=TABLE):
+    """ This function applies remove() to a list of words in one pass"""
+
+    if not words:
+        return []
+    line = " ".join(words).encode("ascii", "ignore")
+    return line.translate(*table).decode().split(" ")
+
+
+def normalize_line(line, table=TABLE):
+    """ This function splits a line into words and applies remove()"""
+
+    return normalize_words(line.split(), table)
+
+
+def normalize_lines(lines, table=TABLE):
+    """ This function applies normalize_line() to a batch of lines"""
+
+    return [normalize_line(line, table) for line in lines]
+
+
+print(normalize_line("“Mr. Darcy!” said ELIZABETH — café, naïve?"))
+print(normalize_line("one; two: three", make_table(";")))
+
+
+# Check that the result is identical to `remove()` for every line of the book and compare the speed.
+
+# In[ ]:
+
+
+import time
+
+with open("pride_and_prejudice.txt", "r") as text:
+    book = text.readlines()
+
+for line in book:
+    assert normalize_line(line) == [remove(word) for word in line.split()], line
+
+start = time.perf_counter()
+old = [[remove(word) for word in line.split()] for line in book]
+time_old = time.perf_counter() - start
+
+start = time.perf_counter()
+new = normalize_lines(book)
+time_new = time.perf_counter() - start
+
+print(old == new)
+print(f"remove()          {time_old:.3f} s")
+print(f"normalize_lines() {time_new:.3f} s")
+
+
+# ##### Counting on several cores
+#
+# The loops above use one core of the CPU. `multiprocessing.Pool` starts several Python processes (workers) and hands out tasks to them.
+#
+# - A big file is cut into byte ranges. Several files are simply several tasks.
+# - A cut can fall into a word. A word belongs to the range in which it *starts*: each worker skips an incomplete first word and reads beyond its end until the last word is complete.
+# - Every worker returns its own dictionary of counts (a *partial* count).
+# - The partial counts are added up in the order of the ranges. Words are therefore added in the order in which they appear in the text and the ranking is identical to `value_counts()`.
+#
+# Note: on Windows and macOS new processes do not inherit the functions of a notebook. The functions then need to be placed in a module file and imported.
+
+# In[ ]:
+
+
+import os
+from multiprocessing import Pool
+
+WHITESPACE = b" \t\n\r\x0b\x0c"
+
+
+def file_ranges(filename, chunk_size=1 << 26):
+    """ This function cuts a file into byte ranges of about chunk_size"""
+
+    # compressed files are read as a whole (end None)
+    if is_compressed(filename):
+        return [(filename, 0, None)]
+    size = os.path.getsize(filename)
+    return [(filename, start, min(start + chunk_size, size))
+            for start in range(0, size, chunk_size)]
+
+
+def count_range(task):
+    """ This function counts the cleaned words starting in the byte range
+    start <= position < end of a file"""
+
+    filename, start, end = task
+    with open_file(filename, "rb") as infile:
+        if start > 0:
+            infile.seek(start - 1)
+            # skip the word which started in the previous range
+            if infile.read(1) not in WHITESPACE:
+                while True:
+                    byte = infile.read(1)
+                    start = start + 1
+                    if not byte or byte in WHITESPACE:
+                        break
+        if end is None:
+            data = infile.read()
+        else:
+            data = infile.read(max(end - start, 0))
+        # complete the last word
+        if data and data[-1:] not in WHITESPACE:
+            while True:
+                byte = infile.read(1)
+                if not byte or byte in WHITESPACE:
+                    break
+                data = data + byte
+
+    return count_data(data)
+
+
+def count_data(data):
+    """ This function counts the cleaned words of bytes read from a file"""
+
+    counts = {}
+    for word in normalize_words(data.decode().split()):
+        counts[word] = counts.get(word, 0) + 1
+    return counts
+
+
+def merge_counts(partials):
+    """ This function adds up a sequence of dictionaries of counts"""
+
+    total = {}
+    for counts in partials:
+        for word, n in counts.items():
+            total[word] = total.get(word, 0) + n
+    return total
+
+
+def count_words_parallel(filenames, processes=None, chunk_size=1 << 26):
+    """ This function counts the words of one or several files with a
+    pool of worker processes"""
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    tasks = []
+    for filename in filenames:
+        tasks.extend(file_ranges(filename, chunk_size))
+
+    with Pool(processes) as pool:
+        return merge_counts(pool.imap(count_range, tasks))
+
+
+df_counts = counts_to_series(count_words_parallel("pride_and_prejudice.txt",
+                                                  chunk_size=1 << 16))
+print(df_counts.iloc[100:120])
+df_counts.to_csv("wordcount.csv")
+
+
+# How does the time change with the number of cores? The book is copied 20 times into a bigger file. The ranges are made small enough that every core gets several of them.
+
+# In[ ]:
+
+
+import time
+
+with open("pride_and_prejudice.txt", "r") as text:
+    book = text.read()
+with open("pride_and_prejudice_x20.txt", "w") as bigfile:
+    for i in range(20):
+        bigfile.write(book)
+
+size = os.path.getsize("pride_and_prejudice_x20.txt")
+reference = None
+for processes in range(1, os.cpu_count() + 1):
+    start = time.perf_counter()
+    counts = count_words_parallel("pride_and_prejudice_x20.txt", processes,
+                                  chunk_size=size // (4 * processes) + 1)
+    elapsed = time.perf_counter() - start
+    if reference is None:
+        reference = elapsed
+    print(f"{processes:3d} processes {elapsed:7.3f} s  speed-up {reference / elapsed:5.2f}")
+
+
+# ##### Writing whole columns at once
+#
+# The loops above convert and write the table value by value. For years of daily data this is slow, and if an error occurs the file is never closed.
+#
+# - The `with` statement closes the file automatically, also after an error.
+# - Converting numbers with `str()` one by one is the slow part. Instead the digits of a whole column are computed with `numpy` arithmetic: `value % 10` is the last digit, `value // 10` removes it.
+# - The characters are stored as their ascii codes in a 2d array of type `uint8`: one row per table row, one column per character. `ord("0")` = 48, `ord("-")` = 45, `ord(" ")` = 32.
+# - `.tobytes()` turns the whole array into one string of bytes, which is written with a single `.write()`. Blocks of rows keep the memory bounded for very long tables.
+# - `layout="aligned"` keeps the blanks and gives right aligned columns. `layout="comma"` uses commas and deletes the blanks, which gives the file `weather_2020.txt` from above.
+# - Floats are written with `decimals` digits after the decimal point, like `fmt` in `np.savetxt`. `np.rint` rounds exact halves to the even number, but `0.05` is stored as a little more than a half in binary and `"%.1f"` gives `0.1`. The few values close to a half are therefore formatted with Python's `%` formatting.
+# - Gaps in the data (`nan`) and infinite values are written as `nan`, `inf` and `-inf`, which `np.loadtxt` reads back.
+
+# In[ ]:
+
+
+def column_width(column, decimals):
+    """ This function returns the number of characters needed to write
+    every value of a column with the given number of decimals"""
+
+    if column.dtype.kind in "iu":
+        decimals = 0
+    if len(column) == 0:
+        return 0
+    finite = np.isfinite(column)
+    # gaps are written as nan, inf or -inf like np.savetxt does
+    width = max((len(str(value)) for value in np.unique(column[~finite])),
+                default=0)
+    if not finite.any():
+        return width
+    largest = int(np.rint(np.abs(column[finite]).max() * 10**decimals)) // 10**decimals
+    digits = len(str(largest))
+    if np.signbit(column[finite]).any():
+        digits = digits + 1
+    if decimals > 0:
+        digits = digits + decimals + 1
+    return max(width, digits)
+
+
+def format_column(column, width, decimals):
+    """ This function returns the right aligned text of a column as
+    array of ascii codes with shape (len(column), width)"""
+
+    finite = np.ones(len(column), dtype=bool)
+    if column.dtype.kind in "iu":
+        decimals = 0
+        value = np.abs(column).astype(np.int64)
+    else:
+        finite = np.isfinite(column)
+        scaled = np.abs(np.where(finite, column, 0.0)) * 10**decimals
+        value = np.rint(scaled).astype(np.int64)
+        # rint rounds halves of the scaled value to even, "%.*f" rounds the
+        # exact binary value: 0.05 -> 0.1, 0.35 -> 0.3
+        for i in np.flatnonzero(np.isclose(scaled - np.floor(scaled), 0.5)):
+            value[i] = int(f"{abs(column[i]):.{decimals}f}".replace(".", ""))
+    need_sign = np.signbit(column) & finite
+
+    text = np.full((len(column), width), ord(" "), dtype=np.uint8)
+    pos = width - 1
+    for i in range(decimals):
+        text[:, pos] = ord("0") + value % 10
+        value = value // 10
+        pos = pos - 1
+    if decimals > 0:
+        text[:, pos] = ord(".")
+        pos = pos - 1
+
+    # the last digit before the decimal point is always written
+    text[:, pos] = ord("0") + value % 10
+    value = value // 10
+    for pos in range(pos - 1, -1, -1):
+        has_digit = value > 0
+        text[:, pos] = np.where(has_digit, ord("0") + value % 10,
+                                np.where(need_sign, ord("-"), ord(" ")))
+        need_sign = need_sign & has_digit
+        value = value // 10
+
+    for i in np.flatnonzero(~finite):
+        word = str(column[i]).encode("ascii")
+        text[i] = ord(" ")
+        text[i, width - len(word):] = np.frombuffer(word, dtype=np.uint8)
+    return text
+
+
+def format_rows(columns, widths, decimals, layout):
+    """ This function returns the text of a block of rows as bytes and
+    the length of every row in bytes"""
+
+    sep = "," if layout == "comma" else " "
+    parts = []
+    for column, width in zip(columns, widths):
+        parts.append(format_column(column, width, decimals))
+        parts.append(np.full((len(column), 1), ord(sep), dtype=np.uint8))
+    # replace the last separator by a line break
+    parts[-1][:] = ord("\n")
+    text = np.hstack(parts)
+    if layout == "comma":
+        keep = text != ord(" ")
+        return text[keep].tobytes(), keep.sum(axis=1)
+    return text.tobytes(), np.full(len(text), text.shape[1])
+
+
+def write_table(filename, names, units, columns, layout="comma",
+                decimals=1, block_size=10**6, level=None):
+    """ This function writes numpy arrays as columns of a text table
+    with a header line of names and a header line of units, level is the
+    compression level of compressed files"""
+
+    if layout == "comma":
+        sep = ","
+    elif layout == "aligned":
+        sep = " "
+    else:
+        raise ValueError(f"unknown layout {layout!r}")
+
+    columns = [np.asarray(column) for column in columns]
+    widths = [column_width(column, decimals) for column in columns]
+    if layout == "comma":
+        header_widths = [0] * len(columns)
+    else:
+        widths = [max(width, len(name), len(unit))
+                  for width, name, unit in zip(widths, names, units)]
+        header_widths = widths
+
+    # an index of an old file with the same name does not fit any more
+    if os.path.exists(filename + ".idx"):
+        os.remove(filename + ".idx")
+
+    with open_file(filename, "w", level) as outfile:
+        outfile.write(sep.join(name.rjust(width)
+                               for name, width in zip(names, header_widths)) + "\n")
+        outfile.write(sep.join(unit.rjust(width)
+                               for unit, width in zip(units, header_widths)) + "\n")
+
+        for start in range(0, len(columns[0]), block_size):
+            block = [column[start:start + block_size] for column in columns]
+            text, _ = format_rows(block, widths, decimals, layout)
+            outfile.write(text.decode("ascii"))
+
+
+names = ("month", "t(high)", "t(low)", "rain")
+units = ("", "C", "C", "mm")
+write_table("weather_2020.txt", names, units, (month, t_high, t_low, rain))
+write_table("weather_2020zip.txt", names, units, (month, t_high, t_low, rain),
+            layout="aligned")
+
+with open("weather_2020zip.txt", "r") as infile:
+    print(infile.read())
+
+
+# Benchmark with daily data for many years against the loop from above and `np.savetxt`. `10**8` rows need several GB of memory, add it to `sizes` only on a big machine.
+
+# In[ ]:
+
+
+import time
+
+
+def write_table_loop(filename, columns):
+    """ This function is the row by row version from above"""
+
+    outfile = open(filename, "w")
+    outfile.write("month,t(high),t(low),rain\n")
+    outfile.write(",C,C,mm\n")
+    for m, th, tl, r in zip(*columns):
+        outfile.write(str(m)+","+str(th)+","+str(tl)+","+str(r)+"\n")
+    outfile.close()
+
+
+sizes = [10**6, 10**7]
+for n in sizes:
+    day = np.arange(n)
+    high = np.round(np.random.normal(15.0, 8.0, n), 1)
+    low = np.round(high - np.random.uniform(2.0, 12.0, n), 1)
+    rainfall = np.round(np.random.exponential(2.0, n), 1)
+    columns = (day, high, low, rainfall)
+
+    start = time.perf_counter()
+    write_table_loop("weather_loop.txt", columns)
+    time_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    np.savetxt("weather_savetxt.txt", np.column_stack(columns),
+               fmt=("%d", "%.1f", "%.1f", "%.1f"), delimiter=",",
+               header="month,t(high),t(low),rain\n,C,C,mm", comments="")
+    time_savetxt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_table("weather_block.txt", names, units, columns)
+    time_block = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_table("weather_aligned.txt", names, units, columns, layout="aligned")
+    time_aligned = time.perf_counter() - start
+
+    print(f"{n:10d} rows  loop {time_loop:6.2f} s  savetxt {time_savetxt:6.2f} s"
+          f"  comma {time_block:6.2f} s  aligned {time_aligned:6.2f} s")
+
+
+# ##### Reading columns into `numpy` arrays
+#
+# The reader above keeps every value as a Python string inside a list of lists. That needs about ten times the memory of the numbers themselves, and `lines.pop(0)` moves all remaining lines by one place.
+#
+# - The two header lines are read first with `.readline()`: names and units.
+# - In the aligned layout empty units are just blanks. A unit belongs to the first name which ends at or after the end of the unit.
+# - `itertools.islice` takes the next `chunk_lines` lines of the file. `np.loadtxt` converts them to a 2d float array in fast C code.
+# - The result arrays are allocated in advance. When they are full their size is doubled, so only a few copies are needed.
+# - Columns written without a decimal point (checked in the first lines) are converted to integers at the end. The type depends on how the file was written, not on the values: a column of `0.0` stays float.
+
+# In[ ]:
+
+
+import re
+from itertools import islice
+
+
+def split_header(names_line, units_line):
+    """ This function returns the column names and the matching units of
+    a comma separated or blank aligned header"""
+
+    if "," in names_line:
+        names = names_line.rstrip("\n").split(",")
+        units = units_line.rstrip("\n").split(",")
+        return names, units
+
+    matches = list(re.finditer(r"\S+", names_line))
+    names = [match.group() for match in matches]
+    units = [""] * len(names)
+    for unit in re.finditer(r"\S+", units_line):
+        for i, match in enumerate(matches):
+            if match.end() >= unit.end():
+                units[i] = unit.group()
+                break
+    return names, units
+
+
+def integer_columns(lines, delimiter, n_check=100):
+    """ This function returns for every column whether its text in the
+    first n_check lines holds only whole numbers (no decimal point)"""
+
+    rows = [line.split(delimiter) for line in lines[:n_check]]
+    return [all(re.fullmatch(r"[+-]?\d+", field.strip()) for field in fields)
+            for fields in zip(*rows)]
+
+
+def parse_table(infile, chunk_lines=10**5):
+    """ This function reads a table written by write_table() from an open
+    text file and returns dictionaries of numpy columns and of units"""
+
+    names_line = infile.readline()
+    delimiter = "," if "," in names_line else None
+    names, units = split_header(names_line, infile.readline())
+
+    data = np.empty((chunk_lines, len(names)))
+    n_rows = 0
+    integer = [False] * len(names)
+    while True:
+        lines = list(islice(infile, chunk_lines))
+        if not lines:
+            break
+        if n_rows == 0:
+            integer = integer_columns(lines, delimiter)
+        block = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+        if n_rows + len(block) > len(data):
+            # double the size of the array
+            bigger = np.empty((2 * len(data), len(names)))
+            bigger[:n_rows] = data[:n_rows]
+            data = bigger
+        data[n_rows:n_rows + len(block)] = block
+        n_rows = n_rows + len(block)
+
+    columns = {}
+    for i, name in enumerate(names):
+        column = data[:n_rows, i].copy()
+        if integer[i]:
+            column = column.astype(np.int64)
+        columns[name] = column
+    return columns, dict(zip(names, units))
+
+
+def read_table(filename, chunk_lines=10**5):
+    """ This function reads a table written by write_table() and returns
+    dictionaries of numpy columns and of units"""
+
+    with open_file(filename, "r") as infile:
+        return parse_table(infile, chunk_lines)
+
+
+table, table_units = read_table("weather_2020.txt")
+print(table_units)
+for name in table:
+    print(name, table[name].dtype, table[name])
+
+table, table_units = read_table("weather_2020zip.txt")
+print(table_units)
+
+
+# Compare memory and time with the list of strings for a long table. `tracemalloc` measures the memory of all Python objects and `numpy` arrays.
+
+# In[ ]:
+
+
+import time
+import tracemalloc
+
+n = 10**6
+write_table("weather_long.txt", names, units,
+            (np.arange(n), np.round(np.random.normal(15.0, 8.0, n), 1),
+             np.round(np.random.normal(5.0, 8.0, n), 1),
+             np.round(np.random.exponential(2.0, n), 1)))
+
+
+def read_lines(filename):
+    """ This function is the list of strings version from above"""
+
+    lines = []
+    with open(filename, "r") as infile:
+        for line in infile:
+            lines.append(line.split(","))
+    return lines[2:]
+
+
+for name, method in [("list of strings", read_lines),
+                     ("numpy columns", read_table)]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = method("weather_long.txt")
+    elapsed = time.perf_counter() - start
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    print(f"{name:16s} {elapsed:6.2f} s  memory {current / 1e6:8.1f} MB")
+
+
+# ##### A binary file format for columns
+#
+# Text files are convenient for humans. A program, however, has to convert every number to text and back again. A binary file stores the bytes of the `numpy` arrays directly.
+#
+# Layout of the file:
+# - 6 bytes `b"COLS1\n"` identify the format.
+# - 8 bytes give the length of the header.
+# - The header is a small JSON text with name, unit, data type, position (`offset`) and length of every column.
+# - The columns follow one after the other. Each starts at a multiple of 64 bytes.
+#
+# `np.memmap` maps one column of the file into memory *without* reading it. The operating system loads the parts which are used. Reading only `rain` does not touch the other columns.
+
+# In[ ]:
+
+
+import json
+
+MAGIC = b"COLS1\n"
+ALIGN = 64
+
+
+def write_binary(filename, columns, units):
+    """ This function writes a dictionary of numpy columns and their units
+    into a binary column file"""
+
+    columns = {name: np.ascontiguousarray(column)
+               for name, column in columns.items()}
+
+    # the positions depend on the header size: repeat until the header fits
+    header_size = 0
+    while True:
+        offset = len(MAGIC) + 8 + header_size
+        info = []
+        for name, column in columns.items():
+            offset = -(-offset // ALIGN) * ALIGN
+            info.append({"name": name, "unit": units.get(name, ""),
+                         "dtype": column.dtype.str, "offset": offset,
+                         "length": len(column)})
+            offset = offset + column.nbytes
+        header = json.dumps(info).encode()
+        if len(header) <= header_size:
+            break
+        header_size = len(header) + ALIGN
+
+    with open(filename, "wb") as outfile:
+        outfile.write(MAGIC)
+        outfile.write(header_size.to_bytes(8, "little"))
+        outfile.write(header.ljust(header_size))
+        for item, column in zip(info, columns.values()):
+            outfile.write(b"\0" * (item["offset"] - outfile.tell()))
+            outfile.write(column.tobytes())
+
+
+def read_binary_header(filename):
+    """ This function returns the header of a binary column file as a
+    dictionary with one entry per column"""
+
+    with open(filename, "rb") as infile:
+        if infile.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a binary column file")
+        header_size = int.from_bytes(infile.read(8), "little")
+        info = json.loads(infile.read(header_size))
+    return {item["name"]: item for item in info}
+
+
+def read_column(filename, name, header=None):
+    """ This function maps a single column of a binary column file into
+    memory without reading it"""
+
+    if header is None:
+        header = read_binary_header(filename)
+    item = header[name]
+    if item["length"] == 0:
+        return np.empty(0, dtype=item["dtype"])
+    return np.memmap(filename, dtype=item["dtype"], mode="r",
+                     offset=item["offset"], shape=(item["length"],))
+
+
+def read_binary(filename):
+    """ This function returns dictionaries of all columns (memory mapped)
+    and units of a binary column file"""
+
+    header = read_binary_header(filename)
+    columns = {name: read_column(filename, name, header) for name in header}
+    units = {name: item["unit"] for name, item in header.items()}
+    return columns, units
+
+
+table, table_units = read_table("weather_2020.txt")
+write_binary("weather_2020.col", table, table_units)
+print(read_binary_header("weather_2020.col"))
+print(read_column("weather_2020.col", "rain"))
+
+
+# Round trip: the columns read back must be identical to the written ones, including the data types and units. Then compare the load time with the text format.
+
+# In[ ]:
+
+
+import time
+
+for filename in ["weather_2020.txt", "weather_long.txt"]:
+    table, table_units = read_table(filename)
+    write_binary("weather.col", table, table_units)
+    columns, col_units = read_binary("weather.col")
+    assert col_units == table_units
+    for name in table:
+        assert columns[name].dtype == table[name].dtype
+        assert np.array_equal(columns[name], table[name])
+
+write_binary("empty.col", {"x": np.zeros(0)}, {})
+assert len(read_column("empty.col", "x")) == 0
+
+start = time.perf_counter()
+table, table_units = read_table("weather_long.txt")
+time_text = time.perf_counter() - start
+
+start = time.perf_counter()
+columns, col_units = read_binary("weather.col")
+loaded = {name: np.array(column) for name, column in columns.items()}
+time_binary = time.perf_counter() - start
+
+start = time.perf_counter()
+rain_total = read_column("weather.col", "rain").sum()
+time_rain = time.perf_counter() - start
+
+print(f"text file              {time_text:8.4f} s")
+print(f"binary, all columns    {time_binary:8.4f} s")
+print(f"binary, sum of rain    {time_rain:8.4f} s")
+
+
+# ##### Appending rows and finding them again quickly
+#
+# Mode `"a"` adds new lines at the end of an existing file. Data arriving every day can be appended without rewriting the file. But a program looking for the last few days would still have to read the whole file.
+#
+# An *index* solves that. Next to `weather.txt` a second file `weather.txt.idx` stores for every `step`th row
+# - the value in the first column (the *key*, e.g. the day) and
+# - the position of the row in the file in bytes (the *offset*).
+#
+# `np.searchsorted` finds the wanted key in the index. `.seek(offset)` jumps to that position and only the rows from there on are read. The keys must increase from row to row.
+#
+# The file is opened in binary mode (`"ab"`, `"rb"`), so the offsets are exact byte positions. `write_table()` deletes an old index, `append_table()` and `read_range()` build a missing index by reading the file once.
+
+# In[ ]:
+
+
+INDEX_DTYPE = np.dtype([("key", "<f8"), ("offset", "<i8")])
+
+
+def build_index(filename, step=1000):
+    """ This function scans a table file once and writes its index file"""
+
+    if is_compressed(filename):
+        raise ValueError(f"{filename}: the index needs an uncompressed file")
+    with open(filename, "rb") as infile:
+        delimiter = b"," if b"," in infile.readline() else None
+        infile.readline()
+        offset = infile.tell()
+        entries = []
+        for i, line in enumerate(infile):
+            if i % step == 0:
+                entries.append((float(line.split(delimiter)[0]), offset))
+            offset = offset + len(line)
+    np.array(entries, dtype=INDEX_DTYPE).tofile(filename + ".idx")
+
+
+def read_index(filename):
+    """ This function returns the index of a table file"""
+
+    return np.fromfile(filename + ".idx", dtype=INDEX_DTYPE)
+
+
+def append_table(filename, columns, decimals=1, step=1000):
+    """ This function appends numpy columns as rows to a table written by
+    write_table() and adds the new rows to the index"""
+
+    if is_compressed(filename):
+        raise ValueError(f"{filename}: the index needs an uncompressed file")
+    if not os.path.exists(filename + ".idx"):
+        build_index(filename, step)
+
+    with open(filename, "rb") as infile:
+        names_line = infile.readline().decode()
+    columns = [np.asarray(column) for column in columns]
+    widths = [column_width(column, decimals) for column in columns]
+    if "," in names_line:
+        layout = "comma"
+    else:
+        layout = "aligned"
+        # the widths of the columns are given by the header
+        ends = [match.end() for match in re.finditer(r"\S+", names_line)]
+        header_widths = [ends[0]] + [end - previous - 1
+                                     for previous, end in zip(ends, ends[1:])]
+        widths = [max(width, header_width)
+                  for width, header_width in zip(widths, header_widths)]
+
+    text, lengths = format_rows(columns, widths, decimals, layout)
+    with open(filename, "ab") as outfile:
+        start = outfile.tell()
+        outfile.write(text)
+
+    offsets = start + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    entries = np.empty(len(offsets[::step]), dtype=INDEX_DTYPE)
+    entries["key"] = columns[0][::step]
+    entries["offset"] = offsets[::step]
+    with open(filename + ".idx", "ab") as indexfile:
+        entries.tofile(indexfile)
+
+
+def read_range(filename, first, last, chunk_lines=10**4):
+    """ This function returns the rows with first <= key <= last as a
+    dictionary of numpy columns, using the index of the file"""
+
+    if is_compressed(filename):
+        raise ValueError(f"{filename}: the index needs an uncompressed file")
+    if not os.path.exists(filename + ".idx"):
+        build_index(filename)
+    index = read_index(filename)
+    with open(filename, "rb") as infile:
+        names_line = infile.readline().decode()
+        delimiter = "," if "," in names_line else None
+        names, units = split_header(names_line, infile.readline().decode())
+
+        # last index entry before the first wanted key
+        i = np.searchsorted(index["key"], first) - 1
+        if i >= 0:
+            infile.seek(index["offset"][i])
+
+        blocks = [np.empty((0, len(names)))]
+        integer = [False] * len(names)
+        while True:
+            lines = [line.decode() for line in islice(infile, chunk_lines)]
+            if not lines:
+                break
+            if len(blocks) == 1:
+                integer = integer_columns(lines, delimiter)
+            block = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+            blocks.append(block[(block[:, 0] >= first) & (block[:, 0] <= last)])
+            if block[-1, 0] > last:
+                break
+
+    data = np.vstack(blocks)
+    columns = {}
+    for i, name in enumerate(names):
+        column = data[:, i]
+        if integer[i]:
+            column = column.astype(np.int64)
+        columns[name] = column
+    return columns
+
+
+# a second year of monthly data is appended to the file from above
+write_table("weather_2020.txt", names, units, (month, t_high, t_low, rain))
+append_table("weather_2020.txt", (month + 12, t_high, t_low, rain), step=4)
+print(read_index("weather_2020.txt"))
+print(read_range("weather_2020.txt", 11, 14))
+
+
+# Ingestion appends a new block of rows again and again. A dashboard only asks for the latest 30 days. Compare with reading the whole file.
+
+# In[ ]:
+
+
+import time
+
+n_days = 1000
+rows_per_day = 1000
+write_table("weather_daily.txt", names, units, ([], [], [], []))
+for day in range(n_days):
+    key = day * rows_per_day + np.arange(rows_per_day)
+    append_table("weather_daily.txt",
+                 (key, np.round(np.random.normal(15.0, 8.0, rows_per_day), 1),
+                  np.round(np.random.normal(5.0, 8.0, rows_per_day), 1),
+                  np.round(np.random.exponential(2.0, rows_per_day), 1)))
+
+first = (n_days - 30) * rows_per_day
+last = n_days * rows_per_day - 1
+
+start = time.perf_counter()
+table, table_units = read_table("weather_daily.txt")
+keep = (table["month"] >= first) & (table["month"] <= last)
+recent_all = {name: column[keep] for name, column in table.items()}
+time_all = time.perf_counter() - start
+
+start = time.perf_counter()
+recent = read_range("weather_daily.txt", first, last)
+time_index = time.perf_counter() - start
+
+for name in recent:
+    assert np.array_equal(recent[name], recent_all[name])
+print(f"read whole file      {time_all:8.4f} s")
+print(f"read with the index  {time_index:8.4f} s")
+
+
+# ##### Pairs and triples of words (n-grams)
+#
+# `value_counts()` counts single words. Often pairs ("bigrams", e.g. *said mr*) or triples ("trigrams") of neighbouring words are interesting, or how often two words appear close to each other (*co-occurrence* within a window of words).
+#
+# Storing every pair as a tuple of two strings needs a lot of memory. Instead:
+#
+# - The words are cleaned with `normalize_words()` (the same result as `remove()`), empty words are dropped.
+# - Every distinct word gets a number (its *id*) in the dictionary `vocab`. The text becomes a `numpy` array of ids.
+# - The ids of an n-gram are packed into one 64 bit integer: 21 bits per word, e.g. `key = (id1 << 21) | id2`. This allows 2 million distinct words and up to 3 words per key.
+# - `np.unique(keys, return_counts=True)` counts the keys of a chunk. The counts of all chunks are merged the same way.
+# - `max_entries` limits the memory: only the most frequent keys are kept after each chunk. Counts of rare n-grams can then be too small (*pruning*), the frequent ones are reliable.
+
+# In[ ]:
+
+
+BITS = 21
+
+
+def token_ids(filename, vocab, chunk_lines=10**5):
+    """ This function yields the ids of the cleaned words of a text file
+    chunk by chunk, adding new words to the dictionary vocab"""
+
+    with open_file(filename, "r") as text:
+        while True:
+            lines = list(islice(text, chunk_lines))
+            if not lines:
+                break
+            words = list(filter(None, normalize_words("".join(lines).split())))
+            # new words in order of first occurrence, then look up all ids
+            for word in dict.fromkeys(words):
+                if word not in vocab:
+                    vocab[word] = len(vocab)
+            ids = list(map(vocab.__getitem__, words))
+            if len(vocab) > 2**BITS:
+                raise ValueError("too many distinct words for 21 bit ids")
+            yield np.array(ids, dtype=np.int64)
+
+
+def pack_ngrams(ids, n):
+    """ This function returns the packed keys of all n-grams of ids"""
+
+    keys = np.zeros(max(len(ids) - n + 1, 0), dtype=np.int64)
+    for i in range(n):
+        keys = (keys << BITS) | ids[i:len(ids) - n + 1 + i]
+    return keys
+
+
+def pack_pairs(ids, window, start=0):
+    """ This function returns the packed keys of all pairs of words at
+    most window words apart whose second word is at index start or
+    later, the smaller id first"""
+
+    keys = [np.zeros(0, dtype=np.int64)]
+    # no pairs further apart than the text is long
+    for distance in range(1, min(window, len(ids) - 1) + 1):
+        first = ids[max(start - distance, 0):len(ids) - distance]
+        second = ids[max(start, distance):]
+        keys.append((np.minimum(first, second) << BITS) | np.maximum(first, second))
+    return np.concatenate(keys)
+
+
+def merge_key_counts(keys, counts, new_keys, new_counts, max_entries=None):
+    """ This function adds two sets of (key, count) and keeps at most
+    max_entries of the most frequent keys"""
+
+    keys = np.concatenate((keys, new_keys))
+    counts = np.concatenate((counts, new_counts))
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts).astype(np.int64)
+    if max_entries is not None and len(keys) > max_entries:
+        keep = np.sort(np.argpartition(counts, -max_entries)[-max_entries:])
+        keys = keys[keep]
+        counts = counts[keep]
+    return keys, counts
+
+
+def count_ngrams(filename, n=2, window=None, max_entries=None,
+                 chunk_lines=10**5):
+    """ This function counts the n-grams of a text file, or the pairs of
+    words within a window if window is given. It returns the vocabulary
+    as a list and the packed keys with their counts"""
+
+    if n * BITS > 63:
+        raise ValueError("at most 3 words fit into one 64 bit key")
+    vocab = {}
+    keys = np.zeros(0, dtype=np.int64)
+    counts = np.zeros(0, dtype=np.int64)
+    # the last words of a chunk start n-grams continued in the next chunk
+    overlap = window if window is not None else n - 1
+    tail = np.zeros(0, dtype=np.int64)
+    for ids in token_ids(filename, vocab, chunk_lines):
+        ids = np.concatenate((tail, ids))
+        if window is None:
+            chunk_keys = pack_ngrams(ids, n)
+        else:
+            # pairs entirely inside the tail were counted before
+            chunk_keys = pack_pairs(ids, window, start=len(tail))
+        new_keys, new_counts = np.unique(chunk_keys, return_counts=True)
+        keys, counts = merge_key_counts(keys, counts, new_keys, new_counts,
+                                        max_entries)
+        tail = ids[max(len(ids) - overlap, 0):]
+    return list(vocab), keys, counts
+
+
+def top_ngrams(words, keys, counts, n=2, k=20):
+    """ This function returns the k most frequent n-grams as a pandas
+    Series with the words as index"""
+
+    best = np.argsort(counts, kind="stable")[::-1][:k]
+    mask = (1 << BITS) - 1
+    labels = []
+    for key in keys[best]:
+        ids = [(int(key) >> (BITS * (n - 1 - i))) & mask for i in range(n)]
+        labels.append(" ".join(words[i] for i in ids))
+    return pd.Series(counts[best], index=labels, name="count")
+
+
+words, keys, counts = count_ngrams("pride_and_prejudice.txt", n=2)
+print(top_ngrams(words, keys, counts, n=2))
+words, keys, counts = count_ngrams("pride_and_prejudice.txt", n=3)
+print(top_ngrams(words, keys, counts, n=3, k=10))
+words, keys, counts = count_ngrams("pride_and_prejudice.txt", window=5)
+print(top_ngrams(words, keys, counts, n=2, k=10))
+
+
+# The book copied 100 times: bigrams with packed integer keys against a `Counter` of tuples of words. The memory is the size of the stored counts, for the packed keys including the vocabulary.
+
+# In[ ]:
+
+
+import sys
+import time
+from collections import Counter
+
+with open("pride_and_prejudice.txt", "r") as source:
+    book = source.read()
+with open("pride_and_prejudice_x100.txt", "w") as target:
+    for i in range(100):
+        target.write(book)
+
+
+def count_bigrams_counter(filename):
+    """ This function counts bigrams as tuples of words"""
+
+    counts = Counter()
+    previous = None
+    with open(filename, "r") as text:
+        for line in text:
+            for word in normalize_words(line.split()):
+                if word:
+                    if previous is not None:
+                        counts[previous, word] += 1
+                    previous = word
+    return counts
+
+
+start = time.perf_counter()
+bigrams = count_bigrams_counter("pride_and_prejudice_x100.txt")
+time_counter = time.perf_counter() - start
+memory_counter = sys.getsizeof(bigrams) + sum(sys.getsizeof(pair) for pair in bigrams)
+
+start = time.perf_counter()
+words, keys, counts = count_ngrams("pride_and_prejudice_x100.txt", n=2)
+time_packed = time.perf_counter() - start
+memory_packed = keys.nbytes + counts.nbytes + sum(sys.getsizeof(word) for word in words)
+
+assert len(keys) == len(bigrams)
+top = top_ngrams(words, keys, counts, n=2, k=5)
+assert all(bigrams[tuple(label.split(" "))] == count for label, count in top.items())
+
+# a text shorter than the window, also split into chunks of one line
+with open("short.txt", "w") as short:
+    short.write("It is\na truth\n")
+for chunk_lines in [1, 10]:
+    short_words, short_keys, short_counts = count_ngrams("short.txt", window=5,
+                                                         chunk_lines=chunk_lines)
+    assert short_counts.sum() == 6
+
+print(f"Counter of tuples  {time_counter:7.2f} s  {memory_counter / 1e6:8.2f} MB")
+print(f"packed keys        {time_packed:7.2f} s  {memory_packed / 1e6:8.2f} MB")
+
+for label, options in [("pruned to 10000", dict(n=2, max_entries=10**4)),
+                       ("trigrams", dict(n=3)),
+                       ("window of 5 words", dict(window=5))]:
+    start = time.perf_counter()
+    words, keys, counts = count_ngrams("pride_and_prejudice_x100.txt", **options)
+    print(f"{label:18s} {time.perf_counter() - start:7.2f} s  {len(keys):9d} keys")
+
+
+# ##### Only the most frequent words (heavy hitters)
+#
+# Above only `df_counts.iloc[100:120]` is printed, but a count is kept for every distinct word. With a very large vocabulary the dictionary does not fit into memory any more. The *Space-Saving* algorithm keeps only a fixed number (`capacity`) of counters:
+#
+# - A word with a counter is counted exactly from then on.
+# - A new word takes the counter of the word with the smallest count $m$ and starts at $m + 1$, since it may have occurred up to $m$ times before. This possible overcount is stored as `error`.
+# - So every count is an upper bound and `count - error` a lower bound of the true count. The error is never larger than $N / \text{capacity}$ for $N$ words in total, and every word occurring more than $N / \text{capacity}$ times is in the summary.
+# - Words are added in chunks: the chunk is counted exactly with `Counter`, then merged into the summary. Two summaries (e.g. of several files or computed on several cores) are merged in the same way: counts and errors are added, for a word missing in one summary its smallest count is used, then the `capacity` largest counts are kept.
+
+# In[ ]:
+
+
+import heapq
+from collections import Counter
+
+
+class SpaceSaving:
+    """ Approximate counts of the most frequent words with a fixed number
+    of counters"""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+
+    def floor(self):
+        """ This method returns the largest possible count of a word
+        without a counter"""
+
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge_counts(self, counts, errors=None, floor=0, total=None):
+        """ This method adds counts (and their errors) of other words"""
+
+        if errors is None:
+            errors = {}
+        own_floor = self.floor()
+        merged = {}
+        merged_errors = {}
+        for word in dict.fromkeys(list(self.counts) + list(counts)):
+            merged[word] = self.counts.get(word, own_floor) + counts.get(word, floor)
+            merged_errors[word] = (self.errors.get(word, own_floor)
+                                   + errors.get(word, floor if word not in counts else 0))
+        if len(merged) > self.capacity:
+            merged = {word: merged[word]
+                      for word in heapq.nlargest(self.capacity, merged, key=merged.get)}
+        self.counts = merged
+        self.errors = {word: merged_errors[word] for word in merged}
+        self.total += sum(counts.values()) if total is None else total
+
+    def update(self, words):
+        """ This method counts a sequence of words"""
+
+        self.merge_counts(Counter(words))
+
+    def merge(self, other):
+        """ This method adds the words counted by another summary"""
+
+        self.merge_counts(other.counts, other.errors, other.floor(), other.total)
+
+    def top(self, k=None):
+        """ This method returns the k largest counts with their lower
+        bounds as a DataFrame sorted like value_counts()"""
+
+        words = list(self.counts)
+        df_top = pd.DataFrame({"count": [self.counts[word] for word in words],
+                               "lower": [self.counts[word] - self.errors[word] for word in words]},
+                              index=pd.Index(words, name="words"))
+        df_top = df_top.sort_values("count", ascending=False, kind="stable")
+        return df_top if k is None else df_top.iloc[:k]
+
+
+def top_words(filename, capacity=1000, chunk_lines=10**4):
+    """ This function returns a SpaceSaving summary of the cleaned words of
+    a text file, read in chunks of lines"""
+
+    summary = SpaceSaving(capacity)
+    with open_file(filename, "r") as text:
+        while True:
+            lines = list(islice(text, chunk_lines))
+            if not lines:
+                break
+            summary.update(normalize_words("".join(lines).split()))
+    return summary
+
+
+summary = top_words("pride_and_prejudice.txt", capacity=1000)
+print(summary.top(120).iloc[100:120])
+
+
+# Time, memory and recall of the 120 most frequent words against the exact `value_counts()`, for the book copied 20 times. Then the same file cut into shards whose summaries are merged, as they could be computed on several cores or machines.
+
+# In[ ]:
+
+
+import time
+import tracemalloc
+
+
+def summary_range(task, capacity=1000):
+    """ This function returns the SpaceSaving summary of a byte range"""
+
+    summary = SpaceSaving(capacity)
+    summary.merge_counts(count_range(task))
+    return summary
+
+
+for name, method in [("value_counts", count_words_dataframe),
+                     ("Space-Saving", lambda f: top_words(f, capacity=1000))]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = method("pride_and_prejudice_x20.txt")
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:13s} {elapsed:8.3f} s  peak memory {peak / 1e6:8.1f} MB")
+
+exact = count_words_dataframe("pride_and_prejudice_x20.txt")
+df_top = result.top(120)
+recall = len(set(df_top.index) & set(exact.index[:120])) / len(exact.index[:120])
+print(f"recall of the 120 most frequent words {recall:.3f}")
+true_counts = exact[df_top.index]
+print("true count between the bounds:",
+      bool(((df_top["lower"] <= true_counts) & (true_counts <= df_top["count"])).all()))
+
+shards = [summary_range(task) for task in file_ranges("pride_and_prejudice_x20.txt", 1 << 20)]
+merged = SpaceSaving(1000)
+for shard in shards:
+    merged.merge(shard)
+df_merged = merged.top(120)
+recall = len(set(df_merged.index) & set(exact.index[:120])) / len(exact.index[:120])
+print(f"{len(shards)} merged shards, recall {recall:.3f}, largest error {max(merged.errors.values())}"
+      f", bound N/capacity = {merged.total / merged.capacity:.0f}")
+
+
+# ##### Storing the text as word numbers
+#
+# `all_words` holds one Python string per word of the text, about 50 bytes or more each, and the DataFrame copies them once more. Most of them are repeated words.
+#
+# - A `Vocabulary` stores every distinct word only once in the list `words` and gives it a number (its *id*), the position in the list. The dictionary `index` finds the id of a word.
+# - The text becomes a sequence of ids in an `array('i')` of 4 byte integers, which grows like a list. `np.frombuffer` looks at it as a `numpy` array without copying.
+# - Counting is then `np.bincount(ids)`: the count of word `i` is at position `i`.
+# - Ids are given in order of first occurrence. With a stable sort the ranking is the same as `value_counts()` and `wordcount.csv` does not change.
+
+# In[ ]:
+
+
+from array import array
+
+
+class Vocabulary:
+    """ Numbers (ids) of distinct words in order of first occurrence"""
+
+    def __init__(self):
+        self.index = {}
+        self.words = []
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, words):
+        """ This method returns the ids of a list of words as int32 array,
+        new words get the next free ids"""
+
+        for word in dict.fromkeys(words):
+            if word not in self.index:
+                self.index[word] = len(self.words)
+                self.words.append(word)
+        return np.fromiter(map(self.index.__getitem__, words), dtype=np.int32,
+                           count=len(words))
+
+    def counts(self, ids):
+        """ This method returns the value_counts() of a sequence of ids as
+        pandas Series"""
+
+        counts = np.bincount(ids, minlength=len(self.words))
+        series = pd.Series(counts, index=pd.Index(self.words, name="words"),
+                           name="count")
+        return series.sort_values(ascending=False, kind="stable")
+
+
+def read_corpus(filename, vocabulary, chunk_lines=10**5):
+    """ This function returns the ids of all cleaned words of a text file
+    as int32 array"""
+
+    corpus = array("i")
+    with open_file(filename, "r") as text:
+        while True:
+            lines = list(islice(text, chunk_lines))
+            if not lines:
+                break
+            ids = vocabulary.add(normalize_words("".join(lines).split()))
+            corpus.frombytes(ids.tobytes())
+    return np.frombuffer(corpus, dtype=np.int32)
+
+
+vocabulary = Vocabulary()
+corpus = read_corpus("pride_and_prejudice.txt", vocabulary)
+df_counts = vocabulary.counts(corpus)
+
+print(df_counts.iloc[100:120])
+df_counts.to_csv("wordcount.csv")
+
+
+# Memory of the stored text and time for reading and counting: list of strings and DataFrame against the ids, for the book copied 20 times.
+
+# In[ ]:
+
+
+import sys
+import time
+
+start = time.perf_counter()
+all_words = []
+with open("pride_and_prejudice_x20.txt", "r") as text:
+    for line in text:
+        for word in line.split():
+            all_words.append(remove(word))
+df_words = pd.DataFrame(data=all_words, columns=("words",))
+counts_strings = df_words["words"].value_counts()
+time_strings = time.perf_counter() - start
+memory_strings = sys.getsizeof(all_words) + sum(sys.getsizeof(word) for word in all_words)
+memory_df = df_words.memory_usage(deep=True).sum()
+
+start = time.perf_counter()
+vocabulary = Vocabulary()
+corpus = read_corpus("pride_and_prejudice_x20.txt", vocabulary)
+counts_ids = vocabulary.counts(corpus)
+time_ids = time.perf_counter() - start
+memory_ids = (corpus.nbytes + sys.getsizeof(vocabulary.words) + sys.getsizeof(vocabulary.index)
+              + sum(sys.getsizeof(word) for word in vocabulary.words))
+
+print(counts_ids.equals(counts_strings))
+print(f"list of strings  {memory_strings / 1e6:8.1f} MB, DataFrame {memory_df / 1e6:8.1f} MB  {time_strings:6.2f} s")
+print(f"ids              {memory_ids / 1e6:8.1f} MB  {time_ids:6.2f} s")
+
+
+# ##### Reading many files at the same time
+#
+# For thousands of small files on a network drive most of the time is spent waiting for the data, not computing. While one file is waiting, others can be read already:
+#
+# - A `ThreadPoolExecutor` reads up to `concurrency` files at the same time. Threads are fine here because Python releases the GIL while waiting for I/O.
+# - `prefetch()` yields the files in their original order, as soon as each one is complete. The data is processed in the main thread with the existing functions, `parse_table()` and `count_data()`, while the next files are read.
+# - At most `depth` files are read ahead. A new read only starts when a file has been taken by the loop (*backpressure*), so a slow consumer does not fill the memory with unread data.
+# - `read_slow()` waits a fixed time before reading, like a slow network drive.
+
+# In[ ]:
+
+
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_file(filename):
+    """ This function returns the content of a file as bytes"""
+
+    with open_file(filename, "rb") as infile:
+        return infile.read()
+
+
+def read_slow(filename, latency=0.02):
+    """ This function reads a file after waiting latency seconds"""
+
+    time.sleep(latency)
+    return read_file(filename)
+
+
+def prefetch(filenames, read=read_file, concurrency=8, depth=None):
+    """ This function yields (filename, content) of all files in order,
+    reading up to concurrency files at once and at most depth ahead"""
+
+    if depth is None:
+        depth = 2 * concurrency
+    filenames = iter(filenames)
+    with ThreadPoolExecutor(concurrency) as pool:
+        pending = deque((filename, pool.submit(read, filename))
+                        for filename in islice(filenames, depth))
+        while pending:
+            filename, future = pending.popleft()
+            data = future.result()
+            # start the next read only when a file has been taken
+            for following in islice(filenames, 1):
+                pending.append((following, pool.submit(read, following)))
+            yield filename, data
+
+
+def read_tables(filenames, read=read_file, concurrency=8):
+    """ This function yields filename, columns and units of tables
+    written by write_table()"""
+
+    for filename, data in prefetch(filenames, read, concurrency):
+        columns, table_units = parse_table(io.StringIO(data.decode()))
+        yield filename, columns, table_units
+
+
+def count_words_files(filenames, read=read_file, concurrency=8):
+    """ This function counts the cleaned words of many text files"""
+
+    return merge_counts(count_data(data)
+                        for filename, data in prefetch(filenames, read, concurrency))
+
+
+stations = []
+for i in range(20):
+    filename = f"station_{i:03d}.txt"
+    write_table(filename, names, units,
+                (np.arange(1, 13), np.round(np.random.normal(15.0, 8.0, 12), 1),
+                 np.round(np.random.normal(5.0, 8.0, 12), 1),
+                 np.round(np.random.exponential(50.0, 12), 1)))
+    stations.append(filename)
+
+for filename, station, station_units in read_tables(stations):
+    assert np.array_equal(station["t(high)"], read_table(filename)[0]["t(high)"])
+print(station)
+
+df_counts = counts_to_series(count_words_files(["pride_and_prejudice.txt"]))
+print(df_counts.iloc[100:120])
+
+
+# Files per second for 200 station files and 20 copies of the book on a slow drive (20 ms per file), against the number of files read at the same time.
+
+# In[ ]:
+
+
+import time
+
+stations = []
+for i in range(200):
+    filename = f"station_{i:03d}.txt"
+    write_table(filename, names, units,
+                (np.arange(1, 13), np.round(np.random.normal(15.0, 8.0, 12), 1),
+                 np.round(np.random.normal(5.0, 8.0, 12), 1),
+                 np.round(np.random.exponential(50.0, 12), 1)))
+    stations.append(filename)
+books = ["pride_and_prejudice.txt"] * 20
+
+for concurrency in [1, 2, 4, 8, 16, 32]:
+    start = time.perf_counter()
+    for filename, station, station_units in read_tables(stations, read_slow, concurrency):
+        pass
+    time_tables = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = count_words_files(books, read_slow, concurrency)
+    time_books = time.perf_counter() - start
+    print(f"{concurrency:3d} threads  tables {len(stations) / time_tables:7.1f} files/s"
+          f"  books {len(books) / time_books:6.1f} files/s")
+
+
+# Compression level against time and file size: a table of 200000 rows written with `write_table()` and read with `read_table()`, and the words of the book copied 20 times counted with `count_words()`.
+
+# In[ ]:
+
+
+import time
+
+n = 2 * 10**5
+long_columns = (np.arange(n), np.round(np.random.normal(15.0, 8.0, n), 1),
+                np.round(np.random.normal(5.0, 8.0, n), 1),
+                np.round(np.random.exponential(2.0, n), 1))
+
+formats = [("", None), (".gz", 1), (".gz", 6), (".gz", 9), (".bz2", 1), (".bz2", 9),
+           (".xz", 0), (".xz", 6)]
+if zstandard is not None:
+    formats += [(".zst", 3), (".zst", 19)]
+
+with open("pride_and_prejudice_x20.txt", "r") as text:
+    book = text.read()
+
+for extension, level in formats:
+    filename = "weather_compressed.txt" + extension
+    start = time.perf_counter()
+    write_table(filename, names, units, long_columns, level=level)
+    time_write = time.perf_counter() - start
+    start = time.perf_counter()
+    read_table(filename)
+    time_read = time.perf_counter() - start
+    size_table = os.path.getsize(filename)
+
+    bookname = "pride_and_prejudice_x20.txt" + extension
+    with open_file(bookname, "w", level) as text:
+        text.write(book)
+    start = time.perf_counter()
+    count_words(bookname)
+    time_count = time.perf_counter() - start
+    size_book = os.path.getsize(bookname)
+
+    print(f"{extension or 'plain':6s} level {str(level):4s}"
+          f"  table: write {time_write:6.2f} s  read {time_read:6.2f} s  {size_table / 1e6:6.2f} MB"
+          f"  book: count {time_count:6.2f} s  {size_book / 1e6:6.2f} MB")
+
+
 # In[ ]:
 
 
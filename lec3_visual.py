@@ -7,15 +7,110 @@
 # In[ ]:
 
 
+import importlib
+import os
+import warnings
+
+import numpy as np
+
+
+class LazyModule:
+    """ Module which is only imported when it is used the first time,
+    setup(module) is called once after the import"""
+
+    def __init__(self, module_name, setup=None):
+        self.module_name = module_name
+        self.setup = setup
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.module_name)
+        if self.setup is not None:
+            setup, self.setup = self.setup, None
+            setup(module)
+        return getattr(module, attribute)
+
+
+def in_notebook():
+    """ This function returns True inside a Jupyter notebook"""
+
+    try:
+        shell = get_ipython()
+    except NameError:
+        return False
+    return type(shell).__name__ == "ZMQInteractiveShell"
+
+
+def close_after_show(pyplot):
+    """ This function makes pyplot.show() close all figures afterwards,
+    like the inline backend of Jupyter does after every cell"""
+
+    show = pyplot.show
+
+    def show_and_close(*args, **kwargs):
+        show(*args, **kwargs)
+        pyplot.close("all")
+
+    pyplot.show = show_and_close
+
+
+if in_notebook():
+    # This is a magic line to inform Jupyter Notebook how to 
+    # display graphics
+    get_ipython().run_line_magic('matplotlib', 'inline')
+else:
+    # plain script (also Spyder): draw without windows unless
+    # the environment variable MPLBACKEND asks for another backend
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    warnings.filterwarnings("ignore", "FigureCanvasAgg is non-interactive")
+
+plt = LazyModule("matplotlib.pyplot",
+                 setup=None if in_notebook() else close_after_show)
+pd = LazyModule("pandas")
+
+
+# The program runs in Jupyter and as a plain script (`python lec3_visual.py`):
+#
+# - `get_ipython()` only exists inside IPython/Jupyter. Outside it, the backend *Agg* is chosen, which draws into files (`plt.savefig`) without opening windows.
+# - Jupyter closes all figures at the end of a cell. In a script `plt.show()` does nothing with *Agg*, so it is changed to close all figures afterwards. Otherwise every figure stays in memory and `plt.figure(1)` draws on top of the old content.
+# - `pandas` and `matplotlib` take a long time to import. `LazyModule` imports them only when `pd.` or `plt.` is used the first time, so code which does not plot does not pay for it.
+#
+# Start-up time of this script with the usual imports compared to the lazy ones, each in a new Python process: once up to the end of the first cell, once up to the end of the first plot. The first plot imports `pyplot` anyway, so there the difference is small.
+#
+# The measurement starts four more Python processes and takes a few seconds. It only runs with `python lec3_visual.py --benchmark`, and needs the file of the script (`__file__`), which does not exist in Jupyter.
+
+# In[ ]:
+
+
+import subprocess
+import sys
+import time
+
+
+def time_startup(filename):
+    """ This function prints the start-up time of a script with eager and
+    with lazy imports, up to its first cell and up to its first plot"""
+
+    with open(filename, "r") as script:
+        source = script.read()
+    setup = source[:source.index("\n# The program runs in Jupyter")]
+    first_plot = source[source.index("\n# #### Line plots"):]
+    first_plot = first_plot[:first_plot.index("\n# ####", 1)]
+    eager = """import os
+os.environ.setdefault("MPLBACKEND", "Agg")
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+"""
+
+    for name, code in [("eager imports", eager), ("lazy imports", setup)]:
+        for part, extra in [("first cell", ""), ("first plot", first_plot)]:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code + extra], check=True)
+            print(f"{name:14s} up to the {part:10s} {time.perf_counter() - start:6.3f} s")
+
 
-# This is a magic line to inform Jupyter Notebook how to 
-# display graphics
-# graphics
-# Do not include in Spyder programs
-get_ipython().run_line_magic('matplotlib', 'inline')
+if "--benchmark" in sys.argv and "__file__" in globals():
+    time_startup(__file__)
 
 
 # #### Line plots - selecting line style and colour
@@ -47,12 +142,216 @@ plt.show()
 #     * `'-.'` dash-dot line style
 #     * `':'` dotted line style
 
+# #### Very long lines
+#
+# A screen or a png file has only a few hundred pixels in x direction. A curve with 10 million points therefore draws thousands of points into the same pixel column, which is slow and makes huge vector (svg, pdf) files.
+#
+# *Min/max decimation* keeps for every pixel column only the smallest and the largest value. The drawn line looks the same, peaks stay visible.
+#
+# - The visible part of the curve is found with `np.searchsorted` (`x` must be sorted).
+# - It is cut into as many blocks as the axes are wide in pixels (`ax.bbox.width`). `.reshape` makes a 2d array with one block per row, `argmin`/`argmax` along the rows find the extreme points of each block.
+# - `DecimatedLine` is a `Line2D`, the class of the lines drawn by `plt.plot`, which keeps all points and overrides the method `draw`. Before each drawing it checks whether the x range (`plt.xlim`, zooming) or the width of the axes in pixels (resizing the window, saving with another `dpi`) changed and then decimates again. It is added with `ax.add_line` and behaves like any other line, also in a copied or pickled figure.
+
+# In[ ]:
+
+
+from matplotlib.lines import Line2D
+
+
+def minmax_indices(y, n_blocks):
+    """ This function returns the sorted indices of the minimum and
+    maximum of y in each of n_blocks blocks"""
+
+    size = len(y) // n_blocks
+    if size < 2:
+        return np.arange(len(y))
+    blocks = y[:n_blocks * size].reshape(n_blocks, size)
+    start = np.arange(n_blocks) * size
+    low = start + np.argmin(blocks, axis=1)
+    high = start + np.argmax(blocks, axis=1)
+    indices = np.sort(np.stack((low, high), axis=1), axis=1).ravel()
+    # the rest which does not fill a whole block and the last point
+    rest = np.arange(n_blocks * size, len(y))
+    return np.concatenate(([0], indices, rest, [len(y) - 1]))
+
+
+class DecimatedLine(Line2D):
+    """ Line which only draws the min/max of each pixel column"""
+
+    def __init__(self, x, y, **kwargs):
+        super().__init__([], [], **kwargs)
+        self.x_all = np.asarray(x)
+        self.y_all = np.asarray(y)
+        self.state = None
+
+    def decimate(self, xmin, xmax):
+        """ This method returns the points to draw between xmin and xmax"""
+
+        if len(self.x_all) == 0:
+            return self.x_all, self.y_all
+        # one point more on each side so the line reaches the border
+        first = max(np.searchsorted(self.x_all, xmin) - 1, 0)
+        last = min(np.searchsorted(self.x_all, xmax) + 1, len(self.x_all))
+        n_blocks = max(int(self.axes.bbox.width), 1)
+        indices = first + minmax_indices(self.y_all[first:last], n_blocks)
+        return self.x_all[indices], self.y_all[indices]
+
+    def update_data(self):
+        """ This method decimates the line again for new x limits or a
+        new size of the axes"""
+
+        state = (self.axes.get_xlim(), int(self.axes.bbox.width))
+        if state != self.state:
+            self.state = state
+            self.set_data(*self.decimate(*state[0]))
+
+    def draw(self, renderer):
+        """ This method decimates the line if needed and draws it, size
+        and dpi of the axes are only known for sure at this point"""
+
+        self.update_data()
+        super().draw(renderer)
+
+
+def plot_decimated(x, y, *args, **kwargs):
+    """ This function plots a long line into the current axes like
+    plt.plot, keeping only the min/max per pixel column"""
+
+    ax = plt.gca()
+    # plt.plot handles format strings like "r--" and the color cycle
+    style, = ax.plot([], [], *args, **kwargs)
+    line = DecimatedLine(x, y, zorder=style.get_zorder())
+    line.update_from(style)
+    style.remove()
+    ax.add_line(line)
+    # the whole line decimated keeps the first, last, smallest and
+    # largest point, so the axes limits fit all points
+    line.set_data(*line.decimate(-np.inf, np.inf))
+    ax.relim()
+    ax.autoscale_view()
+    return line
+
+
+# Render time and file size for 10 million points, compared with `plt.plot`. The figures are written into memory (`io.BytesIO`) instead of files.
+
+# In[ ]:
+
+
+import io
+import time
+
+x_long = np.linspace(0.0, 2.0*np.pi, 10**7)
+y_long = np.sin(x_long) + np.random.normal(0.0, 0.05, len(x_long))
+y_long[5000000] = 2.0  # a single peak must stay visible
+
+for name, method in [("plt.plot", plt.plot), ("decimated", plot_decimated)]:
+    for fmt in ["png", "svg"]:
+        start = time.perf_counter()
+        plt.figure()
+        line = method(x_long, y_long, label="sin(x) + noise")
+        plt.xlim(0.0, 2.0*np.pi)
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format=fmt)
+        plt.close()
+        elapsed = time.perf_counter() - start
+        print(f"{name:10s} {fmt}  {elapsed:7.2f} s  {len(buffer.getvalue()) / 1e6:8.2f} MB")
+
+# zooming in shows the details again
+plt.figure()
+line = plot_decimated(x_long, y_long)
+plt.xlim(3.14, 3.15)
+plt.show()
+
+
+# #### Reading Excel files only once
+#
+# `pd.read_excel` is slow, the whole workbook has to be unpacked and parsed. The measurements are used in several cells below, so the table is converted once into a *pickle* file (`pd.to_pickle`), which `pandas` reads back very quickly.
+#
+# - The cache file `measurements.xlsx.pkl` is used as long as the Excel file does not change.
+# - A small file `measurements.xlsx.json` remembers modification time (`mtime`), size and a checksum (`sha256`) of the Excel file.
+# - If only the modification time changed (e.g. the file was copied), the checksum decides whether the content is still the same.
+# - `columns` selects columns, e.g. only `["phase", "value"]`.
+
+# In[ ]:
+
+
+import hashlib
+import json
+import os
+
+
+def file_checksum(filename, chunk_size=1 << 20):
+    """ This function returns the sha256 checksum of a file"""
+
+    checksum = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def load_excel(filename, columns=None):
+    """ This function returns the first sheet of an Excel file as
+    DataFrame, using a pickle cache which is renewed if the file changes"""
+
+    cache = filename + ".pkl"
+    info_file = filename + ".json"
+    stat = os.stat(filename)
+    info = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+    valid = False
+    if os.path.exists(cache) and os.path.exists(info_file):
+        with open(info_file, "r") as infile:
+            old_info = json.load(infile)
+        if old_info["size"] == info["size"]:
+            if old_info["mtime"] == info["mtime"]:
+                valid = True
+            elif old_info["sha256"] == file_checksum(filename):
+                valid = True
+                old_info["mtime"] = info["mtime"]
+                with open(info_file, "w") as outfile:
+                    json.dump(old_info, outfile)
+
+    if valid:
+        df = pd.read_pickle(cache)
+    else:
+        df = pd.read_excel(filename)
+        df.to_pickle(cache)
+        info["sha256"] = file_checksum(filename)
+        with open(info_file, "w") as outfile:
+            json.dump(info, outfile)
+
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+# Cold load (reads the Excel file and writes the cache) compared with the warm load from the cache.
+
+# In[ ]:
+
+
+import time
+
+for cache_file in ["measurements.xlsx.pkl", "measurements.xlsx.json"]:
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+start = time.perf_counter()
+load_excel("measurements.xlsx")
+print(f"cold load  {time.perf_counter() - start:8.4f} s")
+
+start = time.perf_counter()
+load_excel("measurements.xlsx", columns=["phase", "value"])
+print(f"warm load  {time.perf_counter() - start:8.4f} s")
+
+
 # #### Insert symbols (e.g. lab measurements)
 
 # In[ ]:
 
 
-df_measure = pd.read_excel("measurements.xlsx")
+df_measure = load_excel("measurements.xlsx", columns=["phase", "value"])
 
 plt.figure()
 plt.plot(x, ys, label="sin(x)")
@@ -81,7 +380,7 @@ plt.show()
 # In[ ]:
 
 
-df_measure = pd.read_excel("measurements.xlsx")
+df_measure = load_excel("measurements.xlsx", columns=["phase", "value"])
 
 colour = np.random.randint(0, 6, len(df_measure["phase"]))
 
@@ -220,6 +519,266 @@ plt.hist(rnd_numbers2, range=(-3.0, 4.0), bins=1000, cumulative=True, alpha=0.7,
 plt.show()
 
 
+# #### Histograms of very large samples
+#
+# `plt.hist` needs all values at once and draws one rectangle per bin. For samples which do not fit into memory the counts can be collected chunk by chunk:
+#
+# - `range` and `bins` are fixed in advance, so every chunk is sorted into the same bins.
+# - `np.histogram` counts a chunk, the counts are added up. Only the counts are kept, not the values.
+# - Histograms of different workers with the same bins are combined by adding their counts (`merge`).
+# - `plt.stairs` draws the histogram as one line (or one filled area). The time for drawing does not depend on the sample size any more.
+#
+# As for `plt.hist`, values outside `range` are ignored.
+
+# In[ ]:
+
+
+class Histogram:
+    """ Histogram with fixed bins which is filled chunk by chunk"""
+
+    def __init__(self, range=(-3.0, 3.0), bins=40):
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def add(self, values):
+        """ This method sorts a chunk of values into the bins"""
+
+        self.counts += np.histogram(values, bins=len(self.counts),
+                                    range=(self.edges[0], self.edges[-1]))[0]
+
+    def merge(self, other):
+        """ This method adds the counts of a histogram with the same bins"""
+
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("histograms have different bins")
+        self.counts += other.counts
+
+    def values(self, density=False, cumulative=False):
+        """ This method returns the bin heights like plt.hist would"""
+
+        heights = self.counts.astype(float)
+        if density:
+            heights = heights / (heights.sum() * np.diff(self.edges))
+        if cumulative:
+            if density:
+                heights = np.cumsum(heights * np.diff(self.edges))
+            else:
+                heights = np.cumsum(heights)
+        return heights
+
+    def plot(self, density=False, cumulative=False, fill=True, **kwargs):
+        """ This method draws the histogram with plt.stairs"""
+
+        return plt.stairs(self.values(density, cumulative), self.edges,
+                          fill=fill, **kwargs)
+
+
+# 100 million values in chunks of one million. Two "workers" fill their own histogram, which are merged afterwards.
+
+# In[ ]:
+
+
+import time
+
+chunk = 10**6
+hist1 = Histogram(range=(-3.0, 4.0), bins=40)
+hist2 = Histogram(range=(-3.0, 4.0), bins=40)
+
+start = time.perf_counter()
+for i in range(50):
+    hist1.add(np.random.normal(0.0, 1.0, chunk))
+    hist2.add(np.random.normal(0.0, 1.0, chunk))
+hist1.merge(hist2)
+print(f"counting  {time.perf_counter() - start:8.3f} s")
+
+start = time.perf_counter()
+plt.figure()
+hist1.plot(density=True, alpha=0.7, label="Sample 1")
+plt.legend()
+plt.xlabel("x")
+plt.ylabel("N(x)")
+plt.show()
+print(f"plotting  {time.perf_counter() - start:8.3f} s")
+
+
+# #### Cumulative distributions without histograms
+#
+# The cumulative histogram above sorts the values into 1000 bins and draws 1000 rectangles per sample. The *empirical cumulative distribution function* (ECDF) gives the same curve directly:
+#
+# - Sort the values. The fraction of values $\le x$ jumps by $1/n$ at every value.
+# - `np.unique(..., return_counts=True)` merges equal values, `np.cumsum` adds up the counts.
+# - `points` keeps only that many steps (at evenly spaced fractions), enough for a smooth figure.
+# - `plt.step(x, F, where="post")` draws the result as *one* line.
+#
+# For streams which do not fit into memory a *quantile sketch* keeps a small weighted selection of the values (KLL sketch):
+#
+# - New values go to level 0, each value has weight 1.
+# - If a level holds more than its capacity, it is sorted and every second value (starting at random at the first or second) moves up one level with double weight. The others are dropped.
+# - Higher levels get larger capacities, the memory stays at about `3 * k` values.
+# - Two sketches are merged by joining their levels and compressing again.
+# - The error in the fraction of values shrinks like `1/k`.
+
+# In[ ]:
+
+
+def ecdf(values, points=None):
+    """ This function returns the steps x, F of the empirical cumulative
+    distribution function of the values"""
+
+    x, counts = np.unique(values, return_counts=True)
+    F = np.cumsum(counts) / len(values)
+    if points is not None and len(x) > points:
+        keep = np.searchsorted(F, np.linspace(0.0, 1.0, points + 1)[1:])
+        x = x[keep]
+        F = F[keep]
+    return x, F
+
+
+class QuantileSketch:
+    """ Mergeable KLL sketch of a stream of values"""
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def capacity(self, level):
+        """ This method returns the capacity of a level"""
+
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2.0 / 3.0)**depth)))
+
+    def compress(self):
+        """ This method compacts all levels which are above capacity"""
+
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                odd = len(items) % 2
+                offset = self.rng.integers(2)
+                promoted = items[offset:len(items) - odd:2]
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1],
+                                                         promoted))
+                self.levels[level] = items[len(items) - odd:]
+                # the capacities may have changed, check again from the bottom
+                level = 0
+            else:
+                level = level + 1
+
+    def add(self, values):
+        """ This method adds a chunk of values to the sketch"""
+
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.sum += values.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.compress()
+
+    def merge(self, other):
+        """ This method adds the content of another sketch"""
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def size(self):
+        """ This method returns the number of values kept"""
+
+        return sum(len(items) for items in self.levels)
+
+    def ecdf(self):
+        """ This method returns the steps x, F of the approximate
+        cumulative distribution function"""
+
+        x = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0**level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(x)
+        F = np.cumsum(weights[order])
+        return x[order], F / F[-1]
+
+    def cdf(self, x):
+        """ This method returns the approximate fraction of values <= x"""
+
+        steps, F = self.ecdf()
+        i = np.searchsorted(steps, x, side="right")
+        return np.where(i > 0, F[np.maximum(i - 1, 0)], 0.0)
+
+    def quantile(self, q):
+        """ This method returns approximate quantiles for fractions q"""
+
+        steps, F = self.ecdf()
+        i = np.minimum(np.searchsorted(F, q), len(steps) - 1)
+        return np.where(np.asarray(q) <= 0.0, self.min,
+                        np.where(np.asarray(q) >= 1.0, self.max, steps[i]))
+
+
+# The cumulative histogram from above. Sample 1 exact, sample 2 arrives in chunks and goes through the sketch. Note: `plt.hist` ignores values outside `range`, the ECDF counts all values.
+
+# In[ ]:
+
+
+import time
+
+rnd_numbers = np.random.normal(0.0, 1.0, 10000)
+rnd_numbers2 = np.random.normal(0.5, 1.5, 20000)
+
+start = time.perf_counter()
+fig = plt.figure()
+plt.hist(rnd_numbers, range=(-3.0, 4.0), bins=1000, cumulative=True, alpha=0.7, density=True)
+plt.hist(rnd_numbers2, range=(-3.0, 4.0), bins=1000, cumulative=True, alpha=0.7, density=True)
+plt.savefig("cumulative_hist.png")
+plt.show()
+plt.close(fig)
+time_hist = time.perf_counter() - start
+
+start = time.perf_counter()
+sketch = QuantileSketch(k=200)
+for values in np.split(rnd_numbers2, 20):
+    sketch.add(values)
+
+fig = plt.figure()
+plt.step(*ecdf(rnd_numbers, points=500), where="post", label="Sample 1 (exact)")
+plt.step(*sketch.ecdf(), where="post", label="Sample 2 (sketch)")
+plt.xlim(-3.0, 4.0)
+plt.legend()
+plt.savefig("cumulative_ecdf.png")
+plt.show()
+plt.close(fig)
+time_ecdf = time.perf_counter() - start
+
+print(f"plt.hist with 1000 bins  {time_hist:8.3f} s")
+print(f"ECDF lines               {time_ecdf:8.3f} s")
+
+# accuracy and memory of the sketch for 10 million values
+sketch = QuantileSketch(k=200)
+big = np.random.normal(0.0, 1.0, 10**7)
+for values in np.split(big, 100):
+    sketch.add(values)
+x_test = np.linspace(-3.0, 3.0, 601)
+exact = np.searchsorted(np.sort(big), x_test, side="right") / len(big)
+print(f"sketch keeps {sketch.size()} of {sketch.count} values,"
+      f" largest error {np.abs(sketch.cdf(x_test) - exact).max():.4f}")
+
+
 # ### Pie charts
 # 
 # Pie charts of the GDP of the 5 largest economies in the EU.
@@ -227,10 +786,6 @@ plt.show()
 # In[ ]:
 
 
-get_ipython().run_line_magic('matplotlib', 'inline')
-import numpy as np
-import matplotlib.pyplot as plt
-
 gdp = np.array([3132.670e9, 2225.260e9, 1672.438e9, 1113.851e9])
 countries = ["Germany", "France", "Italy", "Spain"]
 
@@ -317,6 +872,124 @@ plt.show()
 # One can mix different values for $m$ and $n$, e.g., to plot plots inside a plot. Follow this [link](https://matplotlib.org/3.3.1/api/_as_gen/matplotlib.pyplot.subplot.html) to find out more. Scroll to the bottom for plenty of examples.
 # 
 
+# #### Redrawing with new data
+#
+# A dashboard shows the same figure again and again with new data. Building figure, axes, labels and histograms from scratch every time is slow. Instead the figure is built once and only the data of the drawn objects (*artists*) is replaced:
+#
+# - `ax.stairs` returns a `StepPatch`. Its method `set_data` replaces the heights of the histogram.
+# - With *blitting* only the changing artists are drawn again: the background (axes, ticks, labels) is drawn once and stored with `canvas.copy_from_bbox`. For each frame it is copied back (`restore_region`), the histograms are drawn on top (`draw_artist`) and the result is shown (`blit`).
+# - Artists drawn by blitting are `animated` and left out of a normal redraw. A function connected to the `"draw_event"` stores the background again after every full redraw (e.g. resizing the window or `savefig`) and draws the histograms on top, so saved files show them as well.
+
+# In[ ]:
+
+
+class HistogramGrid:
+    """ Grid of histograms which is built once and updated with new data"""
+
+    def __init__(self, n_rows=2, n_cols=2, range=(-4.0, 4.0), bins=50,
+                 ylim=(0.0, 750.0), labels=None, blit=True):
+        self.fig, axes = plt.subplots(n_rows, n_cols)
+        self.fig.subplots_adjust(hspace=0.4, wspace=0.4)
+        self.axes = axes.ravel()
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.blit = blit
+        if labels is None:
+            labels = ["Sample " + str(i + 1) for i, ax in enumerate(self.axes)]
+
+        self.patches = []
+        for ax, label in zip(self.axes, labels):
+            ax.set_xlim(range)
+            ax.set_ylim(ylim)
+            ax.set_xlabel(label)
+            ax.set_ylabel("N")
+            patch = ax.stairs(np.zeros(bins), self.edges, fill=True,
+                              animated=blit)
+            self.patches.append(patch)
+
+        self.background = None
+        self.background_bounds = None
+        if blit:
+            # a closure, matplotlib keeps bound methods only weakly
+            self.fig.canvas.mpl_connect("draw_event", lambda event: self.on_draw(event))
+        self.fig.canvas.draw()
+
+    def on_draw(self, event):
+        """ This method keeps the background for blitting after every full
+        redraw (resize, savefig) and draws the animated histograms on it"""
+
+        canvas = event.canvas
+        if canvas is self.fig.canvas and hasattr(canvas, "copy_from_bbox"):
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+            self.background_bounds = tuple(self.fig.bbox.bounds)
+        for patch in self.patches:
+            patch.draw(event.renderer)
+
+    def update(self, samples):
+        """ This method shows the histograms of a new list of samples"""
+
+        for patch, values in zip(self.patches, samples):
+            patch.set_data(np.histogram(values, bins=self.edges)[0])
+
+        canvas = self.fig.canvas
+        if self.blit and self.background_bounds != tuple(self.fig.bbox.bounds):
+            # the background was taken at another size or dpi
+            canvas.draw()
+        elif self.blit:
+            canvas.restore_region(self.background)
+            for ax, patch in zip(self.axes, self.patches):
+                ax.draw_artist(patch)
+            canvas.blit(self.fig.bbox)
+        else:
+            canvas.draw()
+        canvas.flush_events()
+
+
+# Frames per second for the $2\times 2$ grid of the sub-plot section: building the figure every time, keeping the figure, and keeping the figure with blitting.
+
+# In[ ]:
+
+
+import time
+
+
+def new_samples():
+    """ This function returns four new samples like in the sub-plot cell"""
+
+    return [np.random.normal(-1.0, 1.0, 10000), np.random.normal(1.0, 0.5, 10000),
+            np.random.normal(0.0, 1.5, 10000), np.random.normal(-0.2, 2.0, 10000)]
+
+
+def rebuild(samples):
+    """ This function builds the whole figure again for every frame"""
+
+    fig = plt.figure()
+    plt.subplots_adjust(hspace=0.4, wspace=0.4)
+    for i, sample in enumerate(samples):
+        plt.subplot(2, 2, i + 1)
+        plt.xlim(-4.0, 4.0)
+        plt.ylim(0.0, 750.0)
+        plt.hist(sample, bins=50)
+        plt.xlabel("Sample " + str(i + 1))
+        plt.ylabel("N")
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+frames = 20
+start = time.perf_counter()
+for frame in range(frames):
+    rebuild(new_samples())
+print(f"new figure per frame  {frames / (time.perf_counter() - start):6.1f} frames/s")
+
+for blit in [False, True]:
+    grid = HistogramGrid(blit=blit)
+    start = time.perf_counter()
+    for frame in range(frames):
+        grid.update(new_samples())
+    print(f"kept figure, blit={blit!s:5s} {frames / (time.perf_counter() - start):6.1f} frames/s")
+    plt.close(grid.fig)
+
+
 # ### Boxes and whiskers
 # 
 # Box plots can illustrate the quartile range
@@ -342,7 +1015,7 @@ sample1 = np.random.normal(1.0, 1.0, 10000)
 
 sample2 = np.random.normal(3.0, 2.0, 10000)
 plt.figure()
-plt.boxplot([sample1, sample2], labels=["Sample 1", "Sample 2"])
+plt.boxplot([sample1, sample2], tick_labels=["Sample 1", "Sample 2"])
 plt.ylabel("Ranges")
 plt.show()
 
@@ -353,6 +1026,85 @@ plt.show()
 # - The "whiskers" represents the minimum and maximum.
 # - Outliers are removed and plotted extra.
 
+# #### Box plots for streams
+#
+# `plt.boxplot` sorts all values to find the quartiles. The `QuantileSketch` from the cumulative distribution section gives approximate quartiles from a small selection of the values, also for data which arrives in chunks or is spread over several processes (`merge`).
+#
+# `plt.boxplot` computes a dictionary of statistics per box and passes it to the axes method `bxp`, which only draws. We compute the dictionary from the sketch:
+#
+# - `q1`, `med`, `q3` are the 25%, 50% and 75% quantiles.
+# - `plt.boxplot` ends the whiskers at the last value inside `q1 - 1.5 IQR` and `q3 + 1.5 IQR` (IQR = `q3 - q1`). The sketch keeps too few values to find that value, so the whiskers end at these limits, but not beyond the exact minimum and maximum. For large samples there is a value very close to the limit, so this is nearly the exact whisker.
+# - The values kept by the sketch outside the whiskers, together with the exact minimum and maximum, are shown as outliers. They are only a selection of all outliers.
+# - A larger `k` of the sketch gives a smaller error and needs more memory.
+
+# In[ ]:
+
+
+def box_stats(sketch, label=None, whis=1.5):
+    """ This function returns the statistics of a QuantileSketch as a
+    dictionary for Axes.bxp, all nan for an empty sketch"""
+
+    if sketch.count == 0:
+        return {"label": label, "mean": np.nan, "med": np.nan, "q1": np.nan,
+                "q3": np.nan, "whislo": np.nan, "whishi": np.nan,
+                "fliers": np.zeros(0)}
+    q1, med, q3 = sketch.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    values = np.concatenate(sketch.levels + [[sketch.min, sketch.max]])
+    whislo = max(q1 - whis * iqr, sketch.min)
+    whishi = min(q3 + whis * iqr, sketch.max)
+    fliers = np.unique(values[(values < whislo) | (values > whishi)])
+    return {"label": label, "mean": sketch.sum / sketch.count,
+            "med": med, "q1": q1, "q3": q3,
+            "whislo": whislo, "whishi": whishi, "fliers": fliers}
+
+
+# The two samples of the box plot above, but with 10 million values each, arriving in chunks. The sketch is compared with the exact `np.percentile`.
+
+# In[ ]:
+
+
+import time
+
+n = 10**7
+sample1 = np.random.normal(1.0, 1.0, n)
+sample2 = np.random.normal(3.0, 2.0, n)
+
+start = time.perf_counter()
+exact = [np.percentile(sample, [25.0, 50.0, 75.0]) for sample in (sample1, sample2)]
+time_exact = time.perf_counter() - start
+
+# whiskers like plt.boxplot: last values inside the limits
+exact_whiskers = []
+for sample, (q1, med, q3) in zip((sample1, sample2), exact):
+    iqr = q3 - q1
+    exact_whiskers.append((sample[sample >= q1 - 1.5 * iqr].min(),
+                           sample[sample <= q3 + 1.5 * iqr].max()))
+
+start = time.perf_counter()
+stats = []
+for i, sample in enumerate((sample1, sample2)):
+    sketch = QuantileSketch(k=200)
+    for values in np.split(sample, 100):
+        sketch.add(values)
+    stats.append(box_stats(sketch, label="Sample " + str(i + 1)))
+time_sketch = time.perf_counter() - start
+
+for quartiles, whiskers, box in zip(exact, exact_whiskers, stats):
+    error = np.array([box["q1"], box["med"], box["q3"]]) - quartiles
+    print(box["label"], "largest error of the quartiles", np.abs(error).max())
+    error = np.array([box["whislo"], box["whishi"]]) - whiskers
+    print(box["label"], "largest error of the whiskers ", np.abs(error).max())
+print(f"np.percentile  {time_exact:8.3f} s")
+print(f"sketch         {time_sketch:8.3f} s")
+print("values kept by the sketch", sketch.size(), "of", sketch.count)
+
+fig, ax = plt.subplots()
+ax.bxp(stats)
+ax.set_ylabel("Ranges")
+plt.show()
+
+
 # ### Bar plots
 
 # In[ ]:
@@ -378,10 +1130,6 @@ print(df_countries)
 # In[ ]:
 
 
-import matplotlib.pyplot as plt
-import numpy as np
-get_ipython().run_line_magic('matplotlib', 'inline')
-
 # population data for inner, outer and greater (=inner+outer) London
 # data made numpy arrays for more convenient calculations
 years = np.array([1801, 1851, 1901, 1951, 2001]) 
@@ -403,6 +1151,273 @@ plt.ylabel("population")
 plt.show()
 
 
+# #### A table of countries and years
+#
+# `df_countries` holds one year of five countries. With every country and every year the table gets long, and the country names are stored again in every row as Python strings.
+#
+# - The names are stored only once in `names`. Every row only keeps the number of its country (a *categorical code*) as `int16`.
+# - The years are `int16`, population and GDP `float64`, the urban population in percent `float32`.
+# - Derived columns like GDP/head are computed when they are asked for the first time and then kept (*cached*).
+# - Selecting rows is a boolean mask over the arrays. Summing per country is `np.bincount` with the codes as bins.
+
+# In[ ]:
+
+
+class CountryTable:
+    """ Columns of country indicators with one row per country and year"""
+
+    DERIVED = {"GDP/head": lambda table: table.column("GDP") / table.column("Population")}
+
+    def __init__(self, names, codes, year, population, gdp, urban):
+        self.names = np.asarray(names)
+        self.columns = {"Code": np.asarray(codes, dtype=np.int16),
+                        "Year": np.asarray(year, dtype=np.int16),
+                        "Population": np.asarray(population, dtype=np.float64),
+                        "GDP": np.asarray(gdp, dtype=np.float64),
+                        "Urban population": np.asarray(urban, dtype=np.float32)}
+        self.cache = {}
+
+    @classmethod
+    def from_rows(cls, rows, year):
+        """ This method builds a table from rows [country, population,
+        GDP, urban population] of one year"""
+
+        names = [row[0] for row in rows]
+        return cls(names, np.arange(len(rows)), np.full(len(rows), year),
+                   [row[1] for row in rows], [row[2] for row in rows],
+                   [row[3] for row in rows])
+
+    def column(self, name):
+        """ This method returns a stored or a derived column"""
+
+        if name in self.columns:
+            return self.columns[name]
+        if name not in self.cache:
+            self.cache[name] = self.DERIVED[name](self)
+        return self.cache[name]
+
+    def mask(self, year=None, countries=None):
+        """ This method returns a boolean array of the selected rows"""
+
+        keep = np.ones(len(self.columns["Code"]), dtype=bool)
+        if year is not None:
+            keep &= self.columns["Year"] == year
+        if countries is not None:
+            codes = np.flatnonzero(np.isin(self.names, countries))
+            keep &= np.isin(self.columns["Code"], codes)
+        return keep
+
+    def select(self, name, year=None, countries=None):
+        """ This method returns country names and values of a column for
+        the selected rows"""
+
+        keep = self.mask(year, countries)
+        return self.names[self.columns["Code"][keep]], self.column(name)[keep]
+
+    def total(self, name, year=None):
+        """ This method returns the sum of a column per country"""
+
+        keep = self.mask(year)
+        return np.bincount(self.columns["Code"][keep],
+                           weights=self.column(name)[keep],
+                           minlength=len(self.names))
+
+
+table_countries = CountryTable.from_rows(countries, 2010)
+print(table_countries.select("GDP/head", year=2010))
+
+plt.figure()
+plt.bar(*table_countries.select("Population", year=2010), width=0.8)
+plt.title("Population of countries")
+plt.xlabel("Country")
+plt.ylabel("population")
+plt.show()
+
+plt.figure()
+labels, values = table_countries.select("GDP", countries=["United States", "China", "United Kingdom"])
+plt.pie(values, labels=labels)
+plt.title("GDP")
+plt.show()
+
+
+# Memory and time of a query for 1000 countries over 1000 years, compared with a DataFrame with country names as strings.
+
+# In[ ]:
+
+
+import time
+
+n_countries = 1000
+n_years = 1000
+names = np.array(["Country " + str(i) for i in range(n_countries)])
+codes = np.tile(np.arange(n_countries), n_years)
+year = np.repeat(np.arange(1024, 1024 + n_years), n_countries)
+population = np.random.uniform(1e5, 1e9, len(codes))
+gdp = population * np.random.uniform(1e3, 6e4, len(codes))
+urban = np.random.uniform(10.0, 95.0, len(codes))
+
+table_big = CountryTable(names, codes, year, population, gdp, urban)
+df_big = pd.DataFrame({"Country": names[codes], "Year": year,
+                       "Population": population, "GDP": gdp,
+                       "Urban population": urban})
+
+memory_table = sum(column.nbytes for column in table_big.columns.values())
+memory_df = df_big.memory_usage(deep=True).sum()
+print(f"memory CountryTable {memory_table / 1e6:8.1f} MB")
+print(f"memory DataFrame    {memory_df / 1e6:8.1f} MB")
+
+start = time.perf_counter()
+for i in range(10):
+    rows = df_big[df_big["Year"] == 2010]
+    per_head = rows["GDP"] / rows["Population"]
+    gdp_total = df_big.groupby("Country")["GDP"].sum()
+print(f"query DataFrame     {(time.perf_counter() - start) / 10 * 1e3:8.2f} ms")
+
+start = time.perf_counter()
+for i in range(10):
+    labels, per_head = table_big.select("GDP/head", year=2010)
+    gdp_total = table_big.total("GDP")
+print(f"query CountryTable  {(time.perf_counter() - start) / 10 * 1e3:8.2f} ms")
+
+
+# #### Population series with fast sums over year ranges
+#
+# In the cell above `greater_pop` is stored although it is just `inner_pop + outer_pop`. A small container keeps only the components and computes sums when asked.
+#
+# - `years` must be sorted. Each component has one value per year, or one row per region and one column per year.
+# - `add_sum` defines a new series as the sum of components, e.g. greater = inner + outer. It is computed on first use.
+# - Sums over a range of years use a *prefix sum*: `prefix[j]` is the sum of the first `j` values. The sum from year index `i` to `j-1` is `prefix[j] - prefix[i]`, two look-ups however long the range is.
+# - `np.searchsorted` finds the year indices of a range.
+# - `save` and `load` use `np.savez`, a compressed binary file holding all arrays.
+
+# In[ ]:
+
+
+class YearSeries:
+    """ Series of values per year, for one or many regions"""
+
+    def __init__(self, years, **components):
+        self.years = np.asarray(years)
+        self.components = {name: np.asarray(values)
+                           for name, values in components.items()}
+        self.sums = {}
+        self.cache = {}
+
+    def add_sum(self, name, parts):
+        """ This method defines a series as the sum of other series"""
+
+        self.sums[name] = list(parts)
+        self.cache = {}
+
+    def series(self, name):
+        """ This method returns a component or a derived sum"""
+
+        if name in self.components:
+            return self.components[name]
+        if name not in self.cache:
+            self.cache[name] = sum(self.series(part) for part in self.sums[name])
+        return self.cache[name]
+
+    def prefix(self, name):
+        """ This method returns the prefix sums of a series along the years"""
+
+        key = ("prefix", name)
+        if key not in self.cache:
+            values = self.series(name)
+            zeros = np.zeros(values.shape[:-1] + (1,), dtype=values.dtype)
+            self.cache[key] = np.concatenate((zeros, np.cumsum(values, axis=-1)),
+                                             axis=-1)
+        return self.cache[key]
+
+    def year_indices(self, first, last):
+        """ This method returns the index range i:j of the years
+        first <= year <= last, empty (i == j) if last < first"""
+
+        i = np.searchsorted(self.years, first, side="left")
+        j = np.searchsorted(self.years, last, side="right")
+        return i, max(i, j)
+
+    def range_sum(self, name, first, last):
+        """ This method returns the sum over the years first <= year <= last,
+        0 for an empty range"""
+
+        i, j = self.year_indices(first, last)
+        prefix = self.prefix(name)
+        return prefix[..., j] - prefix[..., i]
+
+    def range_mean(self, name, first, last):
+        """ This method returns the mean over the years first <= year <= last,
+        nan for an empty range"""
+
+        i, j = self.year_indices(first, last)
+        if j == i:
+            return np.full(self.series(name).shape[:-1], np.nan)[()]
+        return self.range_sum(name, first, last) / (j - i)
+
+    def save(self, filename):
+        """ This method writes the series into a compressed npz file"""
+
+        sums = np.array([name + "=" + "+".join(parts)
+                         for name, parts in self.sums.items()])
+        np.savez_compressed(filename, years=self.years, sums=sums,
+                            **self.components)
+
+    @classmethod
+    def load(cls, filename):
+        """ This method reads series written by save()"""
+
+        with np.load(filename) as data:
+            components = {name: data[name] for name in data.files
+                          if name not in ("years", "sums")}
+            series = cls(data["years"], **components)
+            for text in data["sums"]:
+                name, parts = str(text).split("=")
+                series.add_sum(name, parts.split("+"))
+        return series
+
+
+london = YearSeries(years, inner=inner_pop, outer=outer_pop)
+london.add_sum("greater", ["inner", "outer"])
+print(np.array_equal(london.series("greater"), greater_pop))
+print("greater London, sum 1851-1951: ", london.range_sum("greater", 1851, 1951))
+print("inner London, mean 1801-2001:  ", london.range_mean("inner", 1801, 2001))
+
+london.save("london.npz")
+print(YearSeries.load("london.npz").range_sum("greater", 1851, 1951))
+
+
+# 5000 regions with yearly census values over 220 years: 1000 range sums with prefix sums and by adding up the slice every time.
+
+# In[ ]:
+
+
+import time
+
+census_years = np.arange(1801, 2021)
+regions = YearSeries(census_years,
+                     inner=np.random.randint(1000, 10**6, (5000, len(census_years))),
+                     outer=np.random.randint(1000, 10**6, (5000, len(census_years))))
+regions.add_sum("greater", ["inner", "outer"])
+regions.prefix("greater")
+
+first = np.random.randint(1801, 2021, 1000)
+last = np.minimum(first + np.random.randint(0, 100, 1000), 2020)
+
+start = time.perf_counter()
+for a, b in zip(first, last):
+    regions.range_sum("greater", a, b)
+time_prefix = time.perf_counter() - start
+
+values = regions.series("greater")
+start = time.perf_counter()
+for a, b in zip(first, last):
+    values[:, a - 1801:b - 1801 + 1].sum(axis=1)
+time_slice = time.perf_counter() - start
+
+print(f"prefix sums   {time_prefix:7.3f} s")
+print(f"sum of slice  {time_slice:7.3f} s")
+
+
 # ### Area fill
 # 
 # `plt.fill_between(x, y1, y2)` fills the area between arrays (x,y1) and (x,y2).
@@ -453,12 +1468,146 @@ plt.savefig("attainable.png")
 plt.show()
 
 
+# #### Many filled regions at once
+#
+# Every `plt.fill_between` call creates its own object which has to be drawn. For charts with thousands of regions all polygons can be put into a single `PolyCollection`, which is drawn in one go.
+#
+# A region can be given by the corners of its polygon, or by *inequalities* (constraints) like $X_1 + X_2 \le 1$:
+#
+# - Every constraint $a_1 X_1 + a_2 X_2 \le b$ is given as `((a1, a2), b)`. $X_1 \ge 0$ becomes `((-1, 0), 0)`.
+# - Start with the rectangle of the plot range and cut away the part violating each constraint (Sutherland-Hodgman clipping). For one constraint all corners are checked at once with `numpy`.
+# - The label of a region is put at its centroid. Area and centroid of all polygons are computed together from the shoelace formula. Regions which are empty in the plot range get no label.
+
+# In[ ]:
+
+
+from matplotlib.collections import PolyCollection
+
+
+def clip_polygon(vertices, a, b):
+    """ This function returns the part of a polygon with a.x <= b"""
+
+    if len(vertices) == 0:
+        return vertices
+    following = np.roll(vertices, -1, axis=0)
+    s = vertices @ np.asarray(a, dtype=float) - b
+    s_next = np.roll(s, -1)
+    inside = s <= 0.0
+    crossing = inside != (s_next <= 0.0)
+    # point where the edge crosses the line a.x = b
+    t = np.where(crossing, s / np.where(crossing, s - s_next, 1.0), 0.0)
+    cut = vertices + t[:, None] * (following - vertices)
+    # per edge: start corner if inside, then the crossing point
+    points = np.stack((vertices, cut), axis=1)
+    keep = np.stack((inside, crossing), axis=1)
+    return points[keep]
+
+
+def constraint_polygon(constraints, xlim=(-1.3, 1.3), ylim=(-1.3, 1.3)):
+    """ This function returns the polygon of all points in the plot range
+    which fulfil all constraints ((a1, a2), b)"""
+
+    polygon = np.array([[xlim[0], ylim[0]], [xlim[1], ylim[0]],
+                        [xlim[1], ylim[1]], [xlim[0], ylim[1]]])
+    for a, b in constraints:
+        polygon = clip_polygon(polygon, a, b)
+    return polygon
+
+
+def polygon_centroids(polygons):
+    """ This function returns the centroids of a list of polygons, nan
+    for empty polygons and polygons without area"""
+
+    n_max = max([len(polygon) for polygon in polygons] + [1])
+    # repeat the last corner to give all polygons the same length,
+    # an empty polygon becomes a single point without area
+    corners = np.zeros((len(polygons), n_max, 2))
+    for i, polygon in enumerate(polygons):
+        if len(polygon) > 0:
+            corners[i, :len(polygon)] = polygon
+            corners[i, len(polygon):] = polygon[-1]
+    following = np.concatenate((corners[:, 1:], corners[:, :1]), axis=1)
+    cross = corners[:, :, 0] * following[:, :, 1] - following[:, :, 0] * corners[:, :, 1]
+    area = cross.sum(axis=1) / 2.0
+    divisor = np.where(area != 0.0, 6.0 * area, np.nan)
+    cx = ((corners[:, :, 0] + following[:, :, 0]) * cross).sum(axis=1) / divisor
+    cy = ((corners[:, :, 1] + following[:, :, 1]) * cross).sum(axis=1) / divisor
+    return np.column_stack((cx, cy))
+
+
+def fill_regions(polygons, labels=None, colors=None, size=20, **kwargs):
+    """ This function draws polygons as one PolyCollection into the
+    current axes and writes the labels at their centroids"""
+
+    ax = plt.gca()
+    if colors is None:
+        colors = [f"C{i % 10}" for i in range(len(polygons))]
+    collection = PolyCollection(polygons, facecolors=colors, **kwargs)
+    ax.add_collection(collection)
+    ax.autoscale_view()
+    if labels is not None:
+        for (x, y), label in zip(polygon_centroids(polygons), labels):
+            # regions outside the plot range have no centroid
+            if np.isfinite(x):
+                ax.text(x, y, label, size=size, ha="center", va="center")
+    return collection
+
+
+# the attainable portfolio chart from above, given by constraints
+regions = {"E": [((-1, 0), 0), ((0, -1), 0), ((1, 1), 1)],
+           "D": [((-1, 0), 0), ((0, -1), 0), ((-1, -1), -1)],
+           "C": [((-1, 0), 0), ((0, 1), 0)],
+           "B": [((1, 0), 0), ((0, 1), 0)],
+           "A": [((1, 0), 0), ((0, -1), 0)]}
+
+plt.figure(figsize=(6,6))
+plt.xlabel("$X_1$")
+plt.ylabel("$X_2$")
+fill_regions([constraint_polygon(constraints) for constraints in regions.values()],
+             labels=list(regions), colors=["C0", "C1", "C2", "C3", "cyan"])
+plt.show()
+
+
+# A chart with 4900 regions: one `fill_between` per region against a single `PolyCollection`.
+
+# In[ ]:
+
+
+import io
+import time
+
+edges = np.linspace(0.0, 1.0, 71)
+cells = [((x0, x1), (y0, y0), (y1, y1))
+         for x0, x1 in zip(edges[:-1], edges[1:])
+         for y0, y1 in zip(edges[:-1], edges[1:])]
+
+start = time.perf_counter()
+plt.figure(figsize=(6,6))
+for x, y1, y2 in cells:
+    plt.fill_between(x, y1, y2)
+plt.savefig(io.BytesIO(), format="png")
+plt.close()
+time_fill = time.perf_counter() - start
+
+start = time.perf_counter()
+plt.figure(figsize=(6,6))
+polygons = [np.array([[x[0], y1[0]], [x[1], y1[1]], [x[1], y2[1]], [x[0], y2[0]]])
+            for x, y1, y2 in cells]
+fill_regions(polygons)
+plt.savefig(io.BytesIO(), format="png")
+plt.close()
+time_collection = time.perf_counter() - start
+
+print(f"fill_between per region  {time_fill:7.2f} s")
+print(f"one PolyCollection       {time_collection:7.2f} s")
+
+
 # This can be used, e.g, to plot $1 \sigma$ ranges.
 
 # In[ ]:
 
 
-df_measure = pd.read_excel("measurements.xlsx")
+df_measure = load_excel("measurements.xlsx", columns=["phase", "value"])
 yplus = ys + 0.05
 yminus = ys - 0.05
 x = np.linspace(0.0, 2.0*np.pi, 1000)
@@ -478,6 +1627,367 @@ plt.xlim(0.0, 2.0*np.pi)
 plt.show()
 
 
+# #### A band computed from the measurements
+#
+# Above the $1 \sigma$ band is just `ys` $\pm 0.05$. The band can instead be computed from the measurements themselves:
+#
+# - The phase axis is cut into bins. `np.bincount` with the bin number of every point as index adds up counts, sums and squared deviations of all bins in one pass, without a Python loop over the points.
+# - Measurements can arrive in batches. Mean and spread of a new batch are combined with the stored ones by the parallel version of *Welford's* formula: with $\delta$ = difference of the means, $M_2 = M_{2,a} + M_{2,b} + \delta^2 n_a n_b / n$, where $M_2$ is the sum of squared deviations from the mean.
+# - The standard deviation is $\sqrt{M_2 / (n - 1)}$. Bins with less than two points give `nan`, which `fill_between` leaves empty.
+# - Instead of mean and standard deviation, quantiles (16% and 84% correspond to $\pm 1 \sigma$) are more robust against outliers. Sorting the bin number plus the value scaled into $[0, 1)$ orders the points by bin and value at once, then the quantiles of each bin are picked by index.
+
+# In[ ]:
+
+
+class BandAccumulator:
+    """ Running mean and standard deviation per phase bin"""
+
+    def __init__(self, range=(0.0, 2.0*np.pi), bins=50):
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.count = np.zeros(bins)
+        self.mean = np.zeros(bins)
+        self.m2 = np.zeros(bins)
+
+    def bin_index(self, phase):
+        """ This method returns the bin number of each phase (-1 outside)"""
+
+        index = np.searchsorted(self.edges, phase, side="right") - 1
+        index[phase == self.edges[-1]] = len(self.count) - 1
+        index[(index < 0) | (index >= len(self.count))] = -1
+        return index
+
+    def add(self, phase, value):
+        """ This method adds a batch of measurements"""
+
+        phase = np.asarray(phase, dtype=float)
+        value = np.asarray(value, dtype=float)
+        index = self.bin_index(phase)
+        inside = index >= 0
+        index = index[inside]
+        value = value[inside]
+
+        bins = len(self.count)
+        count = np.bincount(index, minlength=bins).astype(float)
+        total = np.bincount(index, weights=value, minlength=bins)
+        mean = np.divide(total, count, out=np.zeros(bins), where=count > 0)
+        m2 = np.bincount(index, weights=(value - mean[index])**2, minlength=bins)
+        self.merge_moments(count, mean, m2)
+
+    def merge_moments(self, count, mean, m2):
+        """ This method combines count, mean and M2 of another set of
+        measurements with the stored ones"""
+
+        n = self.count + count
+        delta = mean - self.mean
+        share = np.divide(count, n, out=np.zeros(len(n)), where=n > 0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + m2 + delta**2 * self.count * share
+        self.count = n
+
+    def merge(self, other):
+        """ This method adds the measurements of another accumulator"""
+
+        self.merge_moments(other.count, other.mean, other.m2)
+
+    def band(self, sigmas=1.0):
+        """ This method returns bin centres, mean, lower and upper band"""
+
+        std = np.full(len(self.count), np.nan)
+        enough = self.count > 1
+        std[enough] = np.sqrt(self.m2[enough] / (self.count[enough] - 1))
+        mean = np.where(self.count > 0, self.mean, np.nan)
+        centres = (self.edges[:-1] + self.edges[1:]) / 2.0
+        return centres, mean, mean - sigmas * std, mean + sigmas * std
+
+
+def quantile_band(phase, value, range=(0.0, 2.0*np.pi), bins=50,
+                  quantiles=(0.16, 0.5, 0.84)):
+    """ This function returns bin centres and the quantiles of the values
+    in each phase bin"""
+
+    accumulator = BandAccumulator(range, bins)
+    index = accumulator.bin_index(np.asarray(phase, dtype=float))
+    value = np.asarray(value, dtype=float)[index >= 0]
+    index = index[index >= 0]
+
+    # bin number plus the value scaled into [0, 1): sorts by bin and value
+    low = value.min() if len(value) > 0 else 0.0
+    scale = np.ptp(value) * (1.0 + 1e-9) if len(value) > 0 else 0.0
+    key = index + (value - low) / (scale or 1.0)
+    value = value[np.argsort(key)]
+    count = np.bincount(index, minlength=bins)
+    first = np.concatenate(([0], np.cumsum(count)[:-1]))
+    result = []
+    filled = count > 0
+    for q in quantiles:
+        position = first[filled] + np.floor(q * (count[filled] - 1)).astype(int)
+        quantile = np.full(bins, np.nan)
+        quantile[filled] = value[position]
+        result.append(quantile)
+    centres = (accumulator.edges[:-1] + accumulator.edges[1:]) / 2.0
+    return (centres, *result)
+
+
+df_measure = load_excel("measurements.xlsx", columns=["phase", "value"])
+band = BandAccumulator(bins=10)
+band.add(df_measure["phase"], df_measure["value"])
+centres, mean, lower, upper = band.band()
+
+plt.figure()
+plt.plot(x, ys, label="sin(x)")
+plt.plot(df_measure["phase"], df_measure["value"], "ko", label="measurement")
+plt.fill_between(centres, lower, upper, alpha=0.3, label="$1 \\sigma$")
+plt.xlabel("phase")
+plt.ylabel("f(x)")
+plt.legend()
+plt.xlim(0.0, 2.0*np.pi)
+plt.show()
+
+
+# Ten million measurements in batches of one million, checked against `np.std` for one bin.
+
+# In[ ]:
+
+
+import time
+
+n = 10**7
+phase = np.random.uniform(0.0, 2.0*np.pi, n)
+value = np.sin(phase) + np.random.normal(0.0, 0.05, n)
+
+start = time.perf_counter()
+band = BandAccumulator(bins=200)
+for i in range(0, n, 10**6):
+    band.add(phase[i:i + 10**6], value[i:i + 10**6])
+centres, mean, lower, upper = band.band()
+print(f"mean and std  {time.perf_counter() - start:6.2f} s")
+
+start = time.perf_counter()
+centres, q16, q50, q84 = quantile_band(phase, value, bins=200)
+print(f"quantiles     {time.perf_counter() - start:6.2f} s")
+
+first_bin = phase < band.edges[1]
+print(upper[0] - mean[0], np.std(value[first_bin], ddof=1))
+
+
+# ### Many figures at once
+#
+# `plt.figure()` and `plt.show()` are made for looking at one figure after the other. To write thousands of figures into files:
+#
+# - `matplotlib.figure.Figure` creates a figure without `pyplot` and without a window. `savefig` draws it with the *Agg* backend, which needs no screen (headless).
+# - Each figure is described by a dictionary (a *spec*): the file name, the kind of plot, the arguments for the plot method of the axes, and title and axis labels.
+# - `multiprocessing.Pool` renders the specs on several cores. The file type (png, svg, pdf) follows from the file name.
+# - An error in one figure does not stop the others. Every result reports the time needed or the error message.
+#
+# Note: on Windows and macOS the functions need to be placed in a module file and imported, see the word count in `Lec4_files_repo.py`.
+
+# In[ ]:
+
+
+import time
+import traceback
+from multiprocessing import Pool
+from matplotlib.figure import Figure
+
+PLOT_METHODS = {"line": "plot", "hist": "hist", "pie": "pie", "bar": "bar",
+                "boxplot": "boxplot", "fill_between": "fill_between"}
+
+
+def render_figure(spec):
+    """ This function draws one figure spec into its file and returns
+    file name, time needed and error message (None if successful)"""
+
+    start = time.perf_counter()
+    try:
+        fig = Figure(figsize=spec.get("figsize", (6.4, 4.8)))
+        ax = fig.add_subplot()
+        method = getattr(ax, PLOT_METHODS[spec["kind"]])
+        method(*spec.get("args", ()), **spec.get("kwargs", {}))
+        ax.set_title(spec.get("title", ""))
+        ax.set_xlabel(spec.get("xlabel", ""))
+        ax.set_ylabel(spec.get("ylabel", ""))
+        if "label" in spec.get("kwargs", {}):
+            ax.legend()
+        fig.savefig(spec["filename"])
+        error = None
+    except Exception:
+        error = traceback.format_exc(limit=1)
+    return spec.get("filename"), time.perf_counter() - start, error
+
+
+def render_batch(specs, processes=None):
+    """ This function renders a list of figure specs with a pool of
+    processes and prints throughput and failures"""
+
+    start = time.perf_counter()
+    with Pool(processes) as pool:
+        results = pool.map(render_figure, specs, chunksize=4)
+    elapsed = time.perf_counter() - start
+
+    failures = [(filename, error) for filename, seconds, error in results
+                if error is not None]
+    print(f"{len(specs)} figures in {elapsed:.2f} s,"
+          f" {len(specs) / elapsed:.1f} figures/s, {len(failures)} failed")
+    for filename, error in failures:
+        print(filename, error)
+    return results
+
+
+x = np.linspace(0.0, 2.0*np.pi, 1000)
+specs = []
+for i in range(20):
+    specs.append({"filename": f"report_{i}_line.png", "kind": "line",
+                  "args": (x, np.sin(x + 0.1 * i)), "kwargs": {"label": "sin(x)"},
+                  "xlabel": "phase", "ylabel": "f(x)"})
+    specs.append({"filename": f"report_{i}_hist.png", "kind": "hist",
+                  "args": (np.random.normal(0.0, 1.0, 10000),),
+                  "kwargs": {"range": (-3.0, 3.0), "bins": 40}})
+    specs.append({"filename": f"report_{i}_pie.svg", "kind": "pie",
+                  "args": ([3132.670e9, 2225.260e9, 1672.438e9, 1113.851e9],),
+                  "kwargs": {"labels": ["Germany", "France", "Italy", "Spain"]},
+                  "title": "GDP largest EU economies"})
+    specs.append({"filename": f"report_{i}_bar.png", "kind": "bar",
+                  "args": (["A", "B", "C"], [3.0, 1.0, 2.0])})
+    specs.append({"filename": f"report_{i}_box.png", "kind": "boxplot",
+                  "args": ([np.random.normal(1.0, 1.0, 1000),
+                            np.random.normal(3.0, 2.0, 1000)],)})
+    specs.append({"filename": f"report_{i}_fill.png", "kind": "fill_between",
+                  "args": (x, np.sin(x) - 0.05, np.sin(x) + 0.05),
+                  "kwargs": {"alpha": 0.3}})
+# a broken spec is reported, the others are still drawn
+specs.append({"filename": "report_broken.png", "kind": "scatter"})
+
+for processes in [1, os.cpu_count()]:
+    results = render_batch(specs, processes)
+
+
+# ### Reproducible random numbers for large samples
+#
+# `np.random.normal` uses one hidden global state. Results change with every run and when several processes or threads draw numbers at the same time. The newer interface is a `np.random.Generator`:
+#
+# - `np.random.SeedSequence(seed).spawn(n)` derives `n` independent seeds from one seed. Each chunk of the sample gets its own generator, so the numbers do not depend on how many threads are used or in which order the chunks are finished.
+# - `rng.standard_normal(out=array, dtype=array.dtype)` fills an existing array *in place*, no new memory is needed. A `float32` array needs half the memory of `float64`. Scaling by `scale` and shifting by `loc` is done in place as well (`*=`, `+=`).
+# - `numpy` releases the global interpreter lock while generating numbers, so a `ThreadPoolExecutor` fills several chunks at the same time.
+# - `normal_chunks` yields one chunk after the other into the *same* buffer, for samples (e.g. $10^9$ values) which are only counted and never stored.
+
+# In[ ]:
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK = 2**20
+
+
+def spawn_seeds(seed, n):
+    """ This function returns n independent seeds derived from a number
+    or a SeedSequence"""
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+
+def fill_normal(out, loc=0.0, scale=1.0, seed=0, chunk_size=CHUNK, threads=None):
+    """ This function fills an array in place with normal random numbers,
+    chunk by chunk with independent generators on several threads"""
+
+    flat = out.reshape(-1)
+    starts = range(0, len(flat), chunk_size)
+    seeds = spawn_seeds(seed, len(starts))
+
+    def fill(start, seed):
+        chunk = flat[start:start + chunk_size]
+        np.random.default_rng(seed).standard_normal(out=chunk, dtype=chunk.dtype)
+        chunk *= scale
+        chunk += loc
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(fill, starts, seeds))
+    return out
+
+
+def fill_integers(out, low, high, seed=0, chunk_size=CHUNK, threads=None):
+    """ This function fills an integer array in place with random
+    integers low <= i < high"""
+
+    flat = out.reshape(-1)
+    starts = range(0, len(flat), chunk_size)
+    seeds = spawn_seeds(seed, len(starts))
+
+    def fill(start, seed):
+        chunk = flat[start:start + chunk_size]
+        chunk[:] = np.random.default_rng(seed).integers(low, high, len(chunk))
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(fill, starts, seeds))
+    return out
+
+
+def normal_samples(loc=0.0, scale=1.0, size=10000, seed=0, threads=None):
+    """ This function returns a new array of normal random numbers"""
+
+    return fill_normal(np.empty(size), loc, scale, seed, threads=threads)
+
+
+def normal_chunks(loc=0.0, scale=1.0, size=10**9, seed=0, chunk_size=10**7,
+                  threads=None):
+    """ This function yields a large normal sample chunk by chunk,
+    always in the same buffer"""
+
+    buffer = np.empty(chunk_size)
+    seeds = spawn_seeds(seed, -(-size // chunk_size))
+    for start, chunk_seed in zip(range(0, size, chunk_size), seeds):
+        chunk = buffer[:min(chunk_size, size - start)]
+        yield fill_normal(chunk, loc, scale, chunk_seed, threads=threads)
+
+
+# the same seed gives the same numbers, independent of the number of threads
+a = normal_samples(1.0, 1.0, 3 * CHUNK + 5, seed=42, threads=1)
+b = normal_samples(1.0, 1.0, 3 * CHUNK + 5, seed=42, threads=4)
+print(np.array_equal(a, b))
+print(fill_integers(np.empty(40, dtype=np.int64), 1, 11, seed=1))
+
+
+# Throughput in million numbers per second. The last lines fill a histogram with $10^8$ values without ever storing them. `10**9` values take a minute or more, use it as `total` only on a big machine.
+
+# In[ ]:
+
+
+import time
+
+n = 10**7
+buffer = np.empty(n)
+
+start = time.perf_counter()
+sample = np.random.normal(0.0, 1.0, n)
+print(f"np.random.normal     {n / (time.perf_counter() - start) / 1e6:8.1f} M/s")
+del sample
+
+for threads in sorted({1, 2, os.cpu_count()}):
+    start = time.perf_counter()
+    fill_normal(buffer, 0.0, 1.0, seed=1, threads=threads)
+    print(f"fill_normal {threads:2d} threads {n / (time.perf_counter() - start) / 1e6:8.1f} M/s")
+
+buffer = np.empty(n, dtype=np.float32)
+start = time.perf_counter()
+fill_normal(buffer, 0.0, 1.0, seed=1)
+print(f"fill_normal float32  {n / (time.perf_counter() - start) / 1e6:8.1f} M/s")
+del buffer
+
+total = 10**8
+start = time.perf_counter()
+hist = Histogram(range=(-4.0, 4.0), bins=50)
+for chunk in normal_chunks(-1.0, 1.0, size=total, seed=7):
+    hist.add(chunk)
+print(f"{total:.0e} values into a histogram in {time.perf_counter() - start:.1f} s")
+
+plt.figure()
+hist.plot(label="Sample 1")
+plt.xlabel("Sample 1")
+plt.ylabel("N")
+plt.show()
+
+
 # In[ ]:
 
 